@@ -0,0 +1,113 @@
+import json
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache, caches
+
+from recipes.versions import get_local_version
+from .search import IngredientIndex
+
+RESPONSE_KEY = 'response:{}'
+RESPONSE_STATS_KEY = 'response:stats:{}'
+
+_catalogs = {}
+_indexes = {}
+_response_stats = {'hits': 0, 'misses': 0}
+
+
+def get_catalog(queryset, serializer_class, version=None):
+    """
+    Возвращает сериализованный каталог модели в виде словаря {id: объект}.
+
+    Каталог хранится в памяти процесса и пересобирается только при смене
+    версии модели. Если version не передана, она берется из копии
+    в памяти процесса, которая сверяется с общим кэшем раз
+    в VERSION_LOCAL_TIMEOUT секунд.
+    """
+    model = queryset.model
+    if version is None:
+        version = get_local_version(model)
+    cached = _catalogs.get(model)
+    if cached is None or cached[0] != version:
+        data = serializer_class(queryset.all(), many=True).data
+        cached = (version, {obj['id']: dict(obj) for obj in data})
+        _catalogs[model] = cached
+    return cached[1]
+
+
+def get_search_index(queryset, serializer_class, version=None):
+    """
+    Возвращает каталог модели и поисковый индекс по названиям его объектов.
+
+    Индекс пересобирается вместе с каталогом при смене версии модели.
+    """
+    catalog = get_catalog(queryset, serializer_class, version)
+    cached = _indexes.get(queryset.model)
+    if cached is None or cached[0] is not catalog:
+        index = IngredientIndex(
+            (pk, obj['name']) for pk, obj in catalog.items()
+        )
+        cached = (catalog, index)
+        _indexes[queryset.model] = cached
+    return cached
+
+
+def get_response_key(request, *parts):
+    """Ключ кэша ответа по адресу, нормализованным параметрам и версиям."""
+    params = sorted(
+        (name, sorted(request.query_params.getlist(name)))
+        for name in request.query_params
+    )
+    key = (request.build_absolute_uri(request.path), params, parts)
+    return RESPONSE_KEY.format(md5(json.dumps(key).encode()).hexdigest())
+
+
+def flush_response_stats():
+    """Переносит статистику процесса в общий кэш."""
+    for name, count in _response_stats.items():
+        if not count:
+            continue
+        key = RESPONSE_STATS_KEY.format(name)
+        cache.add(key, 0, timeout=None)
+        cache.incr(key, count)
+        _response_stats[name] = 0
+
+
+def count_response(hit):
+    """
+    Считает попадания и промахи в памяти процесса и переносит их
+    в общий кэш раз в RESPONSE_STATS_FLUSH запросов, чтобы не писать
+    в общий кэш при каждом запросе.
+    """
+    _response_stats['hits' if hit else 'misses'] += 1
+    if sum(_response_stats.values()) >= settings.RESPONSE_STATS_FLUSH:
+        flush_response_stats()
+
+
+def get_response_stats():
+    flush_response_stats()
+    return {
+        name: cache.get(RESPONSE_STATS_KEY.format(name), 0)
+        for name in _response_stats
+    }
+
+
+def reset_response_stats():
+    _response_stats.update(dict.fromkeys(_response_stats, 0))
+    cache.delete_many(
+        [RESPONSE_STATS_KEY.format(name) for name in _response_stats]
+    )
+
+
+def get_response(key):
+    """
+    Ответы хранятся в кэше процесса: ключ содержит версии данных
+    из общего кэша, поэтому устаревший ответ по нему не найдется.
+    """
+    data = caches['local'].get(key)
+    count_response(hit=data is not None)
+    return data
+
+
+def set_response(key, data):
+    caches['local'].set(key, data, settings.RESPONSE_CACHE_TIMEOUT)
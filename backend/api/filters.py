@@ -1,8 +1,24 @@
-from django.db.models import Value
+from django.conf import settings
+from django.db import connections
+from django.db.models import Case, Exists, F, OuterRef, Value, When
+from django.db.models.functions import Upper
+from django.db.models.lookups import Contains, StartsWith
 from django_filters import rest_framework as filters
 
-from recipes.models import Tag
+from recipes.models import Recipe, Tag
 from users.models import User
+from .cache import get_catalog
+from .serializers import TagSerializer
+
+
+def get_tag_ids():
+    """Id тегов по слагам из каталога тегов в памяти процесса."""
+    catalog = get_catalog(Tag.objects.all(), TagSerializer)
+    return {tag['slug']: pk for pk, tag in catalog.items()}
+
+
+def get_tag_choices():
+    return [(slug, slug) for slug in get_tag_ids()]
 
 
 class RecipeFilter(filters.FilterSet):
@@ -10,21 +26,35 @@ class RecipeFilter(filters.FilterSet):
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_is_in_shopping_cart'
     )
-    tags = filters.ModelMultipleChoiceFilter(
-        field_name='tags__slug',
-        to_field_name='slug',
-        queryset=Tag.objects.all()
+    tags = filters.MultipleChoiceFilter(
+        method='filter_tags',
+        choices=get_tag_choices
     )
     author = filters.ModelChoiceFilter(queryset=User.objects.all())
 
+    def filter_tags(self, queryset, name, value):
+        """
+        Рецепты хотя бы с одним из тегов.
+
+        EXISTS по промежуточной таблице не размножает строки рецептов,
+        поэтому DISTINCT не нужен.
+        """
+        tag_ids = get_tag_ids()
+        return queryset.filter(Exists(
+            Recipe.tags.through.objects.filter(
+                recipe=OuterRef('pk'),
+                tag__in=[tag_ids[slug] for slug in value]
+            )
+        ))
+
     def filter_is_favorited(self, queryset, name, value):
         if self.request.user.is_authenticated and value:
-            return queryset.filter(favorites__user=self.request.user)
+            return queryset.filter(is_favorited=True)
         return queryset
 
     def filter_is_in_shopping_cart(self, queryset, name, value):
         if self.request.user.is_authenticated and value:
-            return queryset.filter(carts__user=self.request.user)
+            return queryset.filter(is_in_shopping_cart=True)
         return queryset
 
 
@@ -32,12 +62,44 @@ class IngredientFilter(filters.FilterSet):
     name = filters.CharFilter(method='filter_name')
 
     def filter_name(self, queryset, name, value):
-        if value:
-            starts_qs = queryset.filter(name__istartswith=value).annotate(
-                priority=Value(1)
-            )
-            contains_qs = queryset.filter(name__icontains=value).exclude(
-                name__istartswith=value
-            ).annotate(priority=Value(2))
-            return starts_qs.union(contains_qs).order_by('priority', 'name')
-        return queryset
+        if not value:
+            return queryset
+        if (
+            settings.INGREDIENT_SEARCH_BACKEND == 'trigram'
+            and connections[queryset.db].vendor == 'postgresql'
+        ):
+            return self.filter_name_trigram(queryset, value)
+        starts_qs = queryset.filter(name__istartswith=value).annotate(
+            priority=Value(1)
+        )
+        contains_qs = queryset.filter(name__icontains=value).exclude(
+            name__istartswith=value
+        ).annotate(priority=Value(2))
+        return starts_qs.union(contains_qs).order_by('priority', 'name')
+
+    @staticmethod
+    def filter_name_trigram(queryset, value):
+        """
+        Поиск через GIN-индекс pg_trgm по UPPER(name).
+
+        Кроме совпадений по началу и вхождению возвращает похожие
+        названия (опечатки), отсортированные по степени сходства.
+        """
+        from django.contrib.postgres.lookups import TrigramSimilar
+        from django.contrib.postgres.search import TrigramSimilarity
+
+        upper_name = Upper('name')
+        value = value.upper()
+        return queryset.filter(
+            Contains(upper_name, value) | TrigramSimilar(upper_name, value)
+        ).annotate(
+            priority=Case(
+                When(StartsWith(upper_name, value), then=Value(1)),
+                When(Contains(upper_name, value), then=Value(2)),
+                default=Value(3),
+            ),
+            similarity=Case(
+                When(priority=3, then=TrigramSimilarity(upper_name, value)),
+                default=Value(0.0),
+            ),
+        ).order_by('priority', F('similarity').desc(), 'name')
@@ -0,0 +1,242 @@
+import json
+import math
+import time
+from pathlib import Path
+from statistics import mode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from recipes.models import Ingredient, Recipe
+from recipes.versions import clear_local_versions
+from users.models import User
+
+BASELINE_PATH = (
+    Path(__file__).resolve().parents[2] / 'benchmarks' / 'baseline.json'
+)
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(values, rank):
+    """Перцентиль rank отсортированного списка методом ближайшего ранга."""
+    return values[max(math.ceil(rank / 100 * len(values)) - 1, 0)]
+
+
+class Command(BaseCommand):
+    help = (
+        'Замер времени ответа и числа запросов к БД основных эндпоинтов '
+        'и сравнение с сохраненными в репозитории базовыми значениями'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument(
+            '--baseline',
+            type=Path,
+            default=BASELINE_PATH,
+            help='Файл с базовыми значениями'
+        )
+        parser.add_argument(
+            '--save',
+            action='store_true',
+            help='Сохранить результаты как новые базовые значения'
+        )
+        parser.add_argument(
+            '--tolerance',
+            type=float,
+            default=0.25,
+            help='Допустимый относительный рост p95'
+        )
+        parser.add_argument(
+            '--min-delta',
+            type=float,
+            default=1.0,
+            help='Рост p95 в миллисекундах, который считается шумом'
+        )
+        parser.add_argument(
+            '--cold',
+            action='store_true',
+            help='Очищать кэш перед каждым запросом'
+        )
+
+    def get_endpoints(self):
+        """Эндпоинты в виде (название, клиент, метод, адрес)."""
+        user = User.objects.annotate(
+            carts_total=Count('carts')
+        ).order_by('-carts_total', 'id').first()
+        recipe = Recipe.objects.order_by('-favorites_count', 'id').first()
+        if user is None or recipe is None:
+            raise CommandError(
+                'Нет данных, сначала выполните generate_dataset'
+            )
+        spare = Recipe.objects.exclude(
+            favorites__user=user
+        ).exclude(carts__user=user).order_by('id').first()
+        ingredient = Ingredient.objects.order_by('id').first()
+        client = APIClient()
+        token, _ = Token.objects.get_or_create(user=user)
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        anon = APIClient()
+        endpoints = [
+            ('recipes_list_anon', anon, 'get', '/api/recipes/'),
+            ('recipes_list', client, 'get', '/api/recipes/'),
+            (
+                'recipes_list_favorited',
+                client,
+                'get',
+                '/api/recipes/?is_favorited=1'
+            ),
+            ('recipe_detail', client, 'get', f'/api/recipes/{recipe.id}/'),
+            (
+                'subscriptions',
+                client,
+                'get',
+                '/api/users/subscriptions/?recipes_limit=3'
+            ),
+            (
+                'ingredients_search',
+                anon,
+                'get',
+                f'/api/ingredients/?name={ingredient.name[:3]}'
+            ),
+            (
+                'download_shopping_cart',
+                client,
+                'get',
+                '/api/recipes/download_shopping_cart/'
+            ),
+        ]
+        if spare is not None:
+            for action in ('favorite', 'shopping_cart'):
+                url = f'/api/recipes/{spare.id}/{action}/'
+                endpoints.extend((
+                    (f'{action}_add', client, 'post', url),
+                    (f'{action}_remove', client, 'delete', url),
+                ))
+        return endpoints
+
+    def request(self, client, method, url, cold):
+        """Выполняет запрос и возвращает время в мс и число запросов."""
+        if cold:
+            for alias in settings.CACHES:
+                caches[alias].clear()
+            clear_local_versions()
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = getattr(client, method)(url)
+            if response.streaming:
+                b''.join(response.streaming_content)
+            elapsed = (time.perf_counter() - start) * 1000
+        if response.status_code >= 400:
+            raise CommandError(
+                f'{method.upper()} {url}: ответ {response.status_code}'
+            )
+        return elapsed, len(queries)
+
+    def measure(self, endpoints, options):
+        """
+        Выполняет запросы по кругу, чтобы добавление и удаление
+        из избранного и корзины чередовались. Число запросов к БД -
+        самое частое на замеряемых кругах, то есть при прогретом кэше:
+        редкие круги с обновлением локальных версий из общего кэша
+        его не завышают.
+        """
+        timings = {name: [] for name, *_ in endpoints}
+        queries = {name: [] for name in timings}
+        for iteration in range(options['warmup'] + options['repeat']):
+            for name, client, method, url in endpoints:
+                elapsed, count = self.request(
+                    client, method, url, options['cold']
+                )
+                if iteration >= options['warmup']:
+                    timings[name].append(elapsed)
+                    queries[name].append(count)
+        results = {}
+        for name, values in timings.items():
+            values.sort()
+            results[name] = {
+                f'p{rank}': round(percentile(values, rank), 3)
+                for rank in PERCENTILES
+            }
+            results[name]['queries'] = mode(queries[name])
+        return results
+
+    def compare(self, results, baseline, options):
+        """Возвращает список регрессий относительно базовых значений."""
+        regressions = []
+        for name, expected in baseline['endpoints'].items():
+            actual = results.get(name)
+            if actual is None:
+                self.stdout.write(self.style.WARNING(
+                    f'{name}: нет в текущем замере'
+                ))
+                continue
+            if actual['queries'] > expected['queries']:
+                regressions.append(
+                    f'{name}: запросов к БД {actual["queries"]}, '
+                    f'было {expected["queries"]}'
+                )
+            limit = (
+                expected['p95'] * (1 + options['tolerance'])
+                + options['min_delta']
+            )
+            if actual['p95'] > limit:
+                regressions.append(
+                    f'{name}: p95 {actual["p95"]:.2f} мс, '
+                    f'было {expected["p95"]:.2f} мс'
+                )
+        return regressions
+
+    @override_settings(ALLOWED_HOSTS=['testserver'])
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError('--repeat должен быть больше нуля')
+        dataset = {
+            'vendor': connection.vendor,
+            'users': User.objects.count(),
+            'recipes': Recipe.objects.count(),
+            'cold': options['cold'],
+        }
+        results = self.measure(self.get_endpoints(), options)
+        for name, result in results.items():
+            self.stdout.write(
+                f'{name}: ' + ', '.join(
+                    f'p{rank} {result[f"p{rank}"]:.2f} мс'
+                    for rank in PERCENTILES
+                ) + f', запросов {result["queries"]}'
+            )
+        path = options['baseline']
+        if options['save']:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(
+                {'dataset': dataset, 'endpoints': results},
+                indent=2,
+                sort_keys=True
+            ) + '\n')
+            self.stdout.write(self.style.SUCCESS(
+                f'Базовые значения сохранены в {path}'
+            ))
+            return
+        if not path.exists():
+            raise CommandError(
+                f'{path}: базовых значений нет, запустите с --save'
+            )
+        baseline = json.loads(path.read_text())
+        if baseline['dataset'] != dataset:
+            self.stdout.write(self.style.WARNING(
+                f'Условия замера отличаются от базовых: {baseline["dataset"]}'
+            ))
+        regressions = self.compare(results, baseline, options)
+        if regressions:
+            raise CommandError(
+                'Регрессии производительности:\n' + '\n'.join(regressions)
+            )
+        self.stdout.write(self.style.SUCCESS('Регрессий нет'))
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+
+from api.cache import get_search_index
+from api.filters import IngredientFilter
+from api.management.timing import measure
+from api.serializers import IngredientSerializer
+from recipes.models import Ingredient
+
+DEFAULT_QUERIES = ('а', 'мо', 'сах', 'соль', 'рис', 'масло', 'ябл', 'ок')
+
+
+class Command(BaseCommand):
+    help = 'Сравнение поиска ингредиентов в памяти с запросом к БД'
+
+    def add_arguments(self, parser):
+        parser.add_argument('queries', nargs='*', default=DEFAULT_QUERIES)
+        parser.add_argument('--repeat', type=int, default=100)
+        parser.add_argument('--limit', type=int, default=None)
+
+    def handle(self, *args, **options):
+        queryset = Ingredient.objects.all()
+        catalog, index = get_search_index(queryset, IngredientSerializer)
+        self.stdout.write(f'Ингредиентов в каталоге: {len(catalog)}')
+        repeat = options['repeat']
+        limit = options['limit']
+        for query in options['queries']:
+            def search_db():
+                result = IngredientFilter(queryset=queryset).filter_name(
+                    queryset, 'name', query
+                )
+                return list(result.values_list('id', flat=True)[:limit])
+
+            def search_index():
+                return index.search(query, limit)
+
+            if search_db() != search_index():
+                self.stdout.write(self.style.WARNING(
+                    f'{query}: результаты поиска различаются'
+                ))
+            db_time = measure(search_db, repeat)
+            index_time = measure(search_index, repeat)
+            self.stdout.write(
+                f'{query!r}: БД {db_time:.3f} мс, '
+                f'индекс {index_time:.3f} мс, '
+                f'ускорение x{db_time / index_time:.1f}'
+            )
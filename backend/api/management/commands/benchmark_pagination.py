@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from rest_framework.test import APIRequestFactory
+
+from api.management.timing import measure
+from api.pagination import KeysetPagination, RecipePagination
+from api.views import RecipeViewSet
+from recipes.models import Recipe
+
+
+class UncachedRecipeViewSet(RecipeViewSet):
+    """Список рецептов без кэша ответов, чтобы замерять запросы к БД."""
+
+    def get_response_cache_key(self, request):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнение времени ответа /api/recipes/ на глубоких страницах '
+        'при постраничной и keyset-пагинации'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'pages', nargs='*', type=int, default=(1, 100, 1000, 10000)
+        )
+        parser.add_argument('--limit', type=int, default=6)
+        parser.add_argument('--repeat', type=int, default=10)
+
+    def measure_view(self, view, url, repeat):
+        """Среднее время ответа представления в миллисекундах."""
+        factory = APIRequestFactory()
+        return measure(lambda: view(factory.get(url)).render(), repeat)
+
+    def get_cursor_url(self, offset, limit):
+        """Адрес keyset-страницы, начинающейся с записи номер offset."""
+        url = f'/api/recipes/?cursor=&limit={limit}'
+        if not offset:
+            return url
+        ordering = RecipePagination.keyset_ordering
+        boundary = Recipe.objects.order_by(*ordering)[offset - 1]
+        keyset = KeysetPagination(ordering)
+        keyset.base_url = url
+        return keyset.encode_cursor(boundary, reverse=False)
+
+    @override_settings(ALLOWED_HOSTS=['testserver'])
+    def handle(self, *args, **options):
+        view = UncachedRecipeViewSet.as_view({'get': 'list'})
+        limit = options['limit']
+        repeat = options['repeat']
+        total = Recipe.objects.count()
+        self.stdout.write(f'Рецептов в базе: {total}')
+        for page in options['pages']:
+            offset = (page - 1) * limit
+            if offset >= total:
+                self.stdout.write(f'Страница {page}: нет данных')
+                continue
+            page_time = self.measure_view(
+                view, f'/api/recipes/?page={page}&limit={limit}', repeat
+            )
+            keyset_time = self.measure_view(
+                view, self.get_cursor_url(offset, limit), repeat
+            )
+            self.stdout.write(
+                f'Страница {page}: page/limit {page_time:.2f} мс, '
+                f'cursor {keyset_time:.2f} мс'
+            )
@@ -0,0 +1,59 @@
+from itertools import combinations
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.filters import RecipeFilter, get_tag_ids
+from api.management.timing import measure
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнение фильтрации рецептов по тегам через JOIN с DISTINCT '
+        'и через EXISTS'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=6)
+        parser.add_argument('--repeat', type=int, default=10)
+        parser.add_argument(
+            '--max-tags',
+            type=int,
+            default=3,
+            help='Наибольшее число тегов в одном запросе'
+        )
+
+    def handle(self, *args, **options):
+        slugs = sorted(get_tag_ids())
+        if not slugs:
+            raise CommandError('В базе нет тегов')
+        self.stdout.write(
+            f'Рецептов: {Recipe.objects.count()}, тегов: {len(slugs)}'
+        )
+        limit = options['limit']
+        repeat = options['repeat']
+        queryset = Recipe.objects.all()
+        for size in range(1, min(options['max_tags'], len(slugs)) + 1):
+            selected = list(next(combinations(slugs, size)))
+            join = queryset.filter(tags__slug__in=selected).distinct()
+            exists = RecipeFilter(queryset=queryset).filter_tags(
+                queryset, 'tags', selected
+            )
+
+            def page_join():
+                return list(join.values_list('id', flat=True)[:limit])
+
+            def page_exists():
+                return list(exists.values_list('id', flat=True)[:limit])
+
+            if page_join() != page_exists() or join.count() != (
+                exists.count()
+            ):
+                raise CommandError(f'{selected}: результаты различаются')
+            self.stdout.write(
+                f'{", ".join(selected)}: '
+                f'страница JOIN {measure(page_join, repeat):.2f} мс, '
+                f'EXISTS {measure(page_exists, repeat):.2f} мс; '
+                f'count JOIN {measure(join.count, repeat):.2f} мс, '
+                f'EXISTS {measure(exists.count, repeat):.2f} мс'
+            )
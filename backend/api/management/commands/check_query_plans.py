@@ -0,0 +1,186 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from api.views import RecipeViewSet
+from recipes.models import (Cart, Favorite, Quantity, Recipe,
+                            ShoppingListItem)
+from users.models import Follow, User
+
+SEQ_SCAN = {
+    'postgresql': r'Seq Scan on "?{}"?\b',
+    'sqlite': r'\bSCAN "?{}\b"?(?! USING)',
+}
+
+# Сортировка результата запроса целиком, а не внутри подзапроса.
+TOP_LEVEL_SORT = {
+    'postgresql': r'Sort Key: [^\n]*\bpub_date\b',
+    'sqlite': r'^\d+ 0 \d+ USE TEMP B-TREE FOR (?:[A-Z0-9 ]+ )?ORDER BY',
+}
+
+
+def unique_index(model, name):
+    """
+    Шаблон имени индекса уникального ограничения в плане: SQLite
+    называет такие индексы sqlite_autoindex_<таблица>_<номер>.
+    """
+    if connection.vendor == 'sqlite':
+        return rf'sqlite_autoindex_{model._meta.db_table}_\d+'
+    return name
+
+
+def foreign_key_index(model, field):
+    """Шаблон имени индекса, который Django создает для внешнего ключа."""
+    column = model._meta.get_field(field).column
+    return rf'{model._meta.db_table}_{column}_[0-9a-f]{{8}}'
+
+
+class Command(BaseCommand):
+    help = (
+        'Проверка по EXPLAIN, что основные запросы к рецептам, избранному, '
+        'корзине и списку покупок используют свои индексы, а списки '
+        'рецептов не сортируются после выборки'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=6)
+        parser.add_argument(
+            '--verbose-plans',
+            action='store_true',
+            help='Выводить планы запросов целиком'
+        )
+
+    def get_recipes(self, user, params):
+        """Queryset страницы списка рецептов в том виде, как его строит API."""
+        request = APIRequestFactory().get('/api/recipes/', params)
+        force_authenticate(request, user)
+        view = RecipeViewSet(
+            action_map={'get': 'list'},
+            format_kwarg=None,
+            kwargs={}
+        )
+        view.request = view.initialize_request(request)
+        return view.filter_queryset(view.get_queryset())
+
+    def get_queries(self, user, limit):
+        """
+        Запросы в виде (название, queryset, шаблоны имен индексов,
+        из которых план должен использовать хотя бы один, и признак
+        того, что порядок по pub_date должен браться из индекса).
+        """
+        recipe_ids = list(
+            Recipe.objects.values_list('id', flat=True)[:limit]
+        )
+        return (
+            (
+                'Список рецептов',
+                self.get_recipes(user, {})[:limit],
+                ('recipe_pub_date_idx',),
+                True,
+            ),
+            (
+                'Рецепты автора',
+                self.get_recipes(user, {'author': user.id})[:limit],
+                ('recipe_author_pub_date_idx',),
+                True,
+            ),
+            (
+                'Избранное',
+                self.get_recipes(user, {'is_favorited': 1})[:limit],
+                (unique_index(Favorite, 'unique_favorites'),),
+                False,
+            ),
+            (
+                'Корзина',
+                self.get_recipes(user, {'is_in_shopping_cart': 1})[:limit],
+                (unique_index(Cart, 'unique_carts'),),
+                False,
+            ),
+            (
+                'Ингредиенты рецептов',
+                Quantity.objects.filter(
+                    recipe__in=recipe_ids
+                ).select_related('ingredient'),
+                ('quantity_recipe_ingredient_idx',),
+                False,
+            ),
+            (
+                'Подписки',
+                User.objects.filter(followers__user=user)[:limit],
+                (
+                    unique_index(Follow, 'unique_followers'),
+                    foreign_key_index(Follow, 'user'),
+                ),
+                False,
+            ),
+            (
+                'Список покупок',
+                ShoppingListItem.objects.filter(user=user).values_list(
+                    'ingredient__name',
+                    'ingredient__measurement_unit',
+                    'total'
+                ).order_by('ingredient__name'),
+                (
+                    unique_index(
+                        ShoppingListItem, 'unique_shopping_list_items'
+                    ),
+                    foreign_key_index(ShoppingListItem, 'user'),
+                ),
+                False,
+            ),
+        )
+
+    def check_plan(self, plan, tables, indexes, ordered):
+        """Список проблем плана запроса."""
+        vendor = connection.vendor
+        problems = [
+            f'полный просмотр {table}' for table in tables
+            if re.search(SEQ_SCAN[vendor].format(table), plan)
+        ]
+        if not any(re.search(rf'\b{index}\b', plan) for index in indexes):
+            problems.append(f'нет индекса {" или ".join(indexes)}')
+        if ordered and re.search(TOP_LEVEL_SORT[vendor], plan, re.M):
+            problems.append('сортировка вместо порядка индекса')
+        return problems
+
+    @override_settings(ALLOWED_HOSTS=['testserver'])
+    def handle(self, *args, **options):
+        if connection.vendor not in SEQ_SCAN:
+            raise CommandError(
+                f'EXPLAIN для {connection.vendor} не поддерживается'
+            )
+        user = User.objects.annotate(
+            favorites_total=Count('favorites', distinct=True),
+            carts_total=Count('carts', distinct=True),
+        ).order_by('-favorites_total', '-carts_total').first()
+        if user is None:
+            raise CommandError('В базе нет пользователей')
+        tables = [
+            model._meta.db_table
+            for model in (
+                Recipe, Favorite, Cart, Quantity, ShoppingListItem, Follow
+            )
+        ]
+        failed = []
+        for name, queryset, indexes, ordered in self.get_queries(
+            user, options['limit']
+        ):
+            plan = queryset.explain()
+            if options['verbose_plans']:
+                self.stdout.write(f'{name}:\n{plan}\n')
+            problems = self.check_plan(plan, tables, indexes, ordered)
+            if problems:
+                failed.append(name)
+                self.stdout.write(self.style.ERROR(
+                    f'{name}: {"; ".join(problems)}'
+                ))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'{name}: индексы'))
+        if failed:
+            raise CommandError(
+                'Запросы без нужных индексов: ' + ', '.join(failed)
+            )
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from api.cache import get_response_stats, reset_response_stats
+
+
+class Command(BaseCommand):
+    help = 'Статистика попаданий в кэш ответов со списком рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true')
+
+    def handle(self, *args, **options):
+        stats = get_response_stats()
+        total = stats['hits'] + stats['misses']
+        ratio = stats['hits'] / total * 100 if total else 0
+        self.stdout.write(
+            f'Попаданий: {stats["hits"]}, промахов: {stats["misses"]}, '
+            f'доля попаданий: {ratio:.1f}%'
+        )
+        if options['reset']:
+            reset_response_stats()
+            self.stdout.write(self.style.SUCCESS('Счетчики сброшены'))
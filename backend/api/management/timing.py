@@ -0,0 +1,9 @@
+import time
+
+
+def measure(func, repeat):
+    """Среднее время выполнения функции в миллисекундах."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1000
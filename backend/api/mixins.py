@@ -1,4 +1,16 @@
+import copy
+import json
+from hashlib import md5
+
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.http import Http404
+from django.utils.cache import get_conditional_response
 from rest_framework import mixins, viewsets
+from rest_framework.response import Response
+
+from recipes.versions import get_local_version
+from .cache import get_catalog, get_response, set_response
+from .uploadhandlers import SizeLimitUploadHandler
 
 
 class CreateListRetrieveMixin(
@@ -8,3 +20,135 @@ class CreateListRetrieveMixin(
     viewsets.GenericViewSet
 ):
     pass
+
+
+class StreamedUploadMixin:
+    """
+    Пишет загружаемые файлы во временный файл по частям
+    и прерывает загрузку при превышении допустимого размера.
+    """
+
+    def initialize_request(self, request, *args, **kwargs):
+        request.upload_handlers = [
+            SizeLimitUploadHandler(request),
+            TemporaryFileUploadHandler(request),
+        ]
+        return super().initialize_request(request, *args, **kwargs)
+
+
+class CatalogCacheMixin:
+    """Отдает список и объекты справочника из кэша в памяти процесса."""
+
+    def get_catalog_version(self, request):
+        """
+        Версия справочника, прочитанная один раз за запрос: по ней
+        строятся и ETag, и каталог.
+        """
+        if not hasattr(request, 'catalog_version'):
+            request.catalog_version = get_local_version(self.queryset.model)
+        return request.catalog_version
+
+    def get_catalog(self, request):
+        return get_catalog(
+            self.queryset,
+            self.serializer_class,
+            self.get_catalog_version(request)
+        )
+
+    def get_list_data(self, request):
+        return list(self.get_catalog(request).values())
+
+    def list(self, request, *args, **kwargs):
+        return Response(self.get_list_data(request))
+
+    def retrieve(self, request, *args, **kwargs):
+        catalog = self.get_catalog(request)
+        pk = kwargs[self.lookup_field]
+        if not pk.isdigit() or int(pk) not in catalog:
+            raise Http404
+        return Response(catalog[int(pk)])
+
+
+class ConditionalGetMixin:
+    """
+    Отвечает 304 на условные запросы list и retrieve до сериализации.
+
+    ETag строится из адреса, формата ответа и версий моделей из
+    get_etag_parts(). Last-Modified не отдается: время изменения записи
+    не учитывает изменений связанных данных, и по одному
+    If-Modified-Since клиент получил бы 304 на изменившийся ответ.
+    """
+
+    def get_etag_parts(self, request):
+        return ()
+
+    def conditional(self, handler, request, *args, **kwargs):
+        parts = (
+            request.get_full_path(),
+            request.accepted_renderer.format,
+            *self.get_etag_parts(request),
+        )
+        etag = '"{}"'.format(
+            md5(json.dumps(parts, default=str).encode()).hexdigest()
+        )
+        response = get_conditional_response(request, etag=etag)
+        if response is not None:
+            return response
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            response['ETag'] = etag
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(super().retrieve, request, *args, **kwargs)
+
+
+class ResponseCacheMixin:
+    """
+    Кэширует данные ответов list и retrieve, общие для всех пользователей.
+
+    В кэш попадает анонимное представление, поля, зависящие от
+    пользователя, восстанавливаются в personalize() после чтения.
+    Поля, которые меняются без смены ключа кэша, обновляются
+    в refresh_cached(). get_response_cache_key() возвращает None
+    для некэшируемых запросов.
+    """
+
+    def get_response_cache_key(self, request):
+        return None
+
+    def refresh_cached(self, data):
+        return data
+
+    def anonymize(self, data):
+        return data
+
+    def personalize(self, request, data):
+        return data
+
+    def cached(self, handler, request, *args, **kwargs):
+        key = self.get_response_cache_key(request)
+        if key is None:
+            return handler(request, *args, **kwargs)
+        data = get_response(key)
+        if data is not None:
+            data = self.refresh_cached(data)
+            if request.user.is_authenticated:
+                data = self.personalize(request, data)
+            return Response(data)
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            data = response.data
+            if request.user.is_authenticated:
+                data = self.anonymize(copy.deepcopy(data))
+            set_response(key, data)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached(super().retrieve, request, *args, **kwargs)
@@ -0,0 +1,18 @@
+from rest_framework.exceptions import NotAcceptable
+from rest_framework.negotiation import DefaultContentNegotiation
+
+
+class FallbackContentNegotiation(DefaultContentNegotiation):
+    """
+    Выбирает первый рендерер, если ни один не подходит под заголовок
+    Accept, вместо ответа 406.
+
+    Неизвестный формат в параметре format по-прежнему дает 404.
+    """
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        try:
+            return super().select_renderer(request, renderers, format_suffix)
+        except NotAcceptable:
+            renderer = renderers[0]
+            return renderer, renderer.media_type
@@ -1,5 +1,267 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator as DjangoPaginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from recipes.models import Tag
+from recipes.versions import ROWS_SCOPE, get_versions
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset-пагинация по уникальному набору полей ordering.
+
+    Курсор хранит значения полей ordering крайней записи страницы,
+    поэтому запрос не зависит от глубины страницы и не требует COUNT.
+    """
+
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    page_size = api_settings.PAGE_SIZE
+    invalid_cursor_message = 'Неверный курсор'
+
+    def __init__(self, ordering):
+        self.ordering = ordering
+
+    def get_page_size(self, request):
+        page_size = request.query_params.get(self.page_size_query_param)
+        if page_size and page_size.isdigit() and int(page_size) > 0:
+            return int(page_size)
+        return self.page_size
+
+    @staticmethod
+    def get_field_name(ordering):
+        return ordering.lstrip('-')
+
+    @staticmethod
+    def invert(ordering):
+        if ordering.startswith('-'):
+            return ordering[1:]
+        return f'-{ordering}'
+
+    def get_keyset_filter(self, ordering, values):
+        """Условие «строго после» записи со значениями values."""
+        condition = Q()
+        equal = Q()
+        for field, value in zip(ordering, values):
+            name = self.get_field_name(field)
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            payload = json.loads(urlsafe_b64decode(encoded.encode()))
+            if len(payload['v']) != len(self.ordering):
+                raise ValueError
+            values = [
+                model._meta.get_field(self.get_field_name(field)).to_python(
+                    value
+                ) for field, value in zip(self.ordering, payload['v'])
+            ]
+            return values, bool(payload['r'])
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, obj, reverse):
+        values = [
+            obj._meta.get_field(self.get_field_name(field)).value_to_string(
+                obj
+            ) for field in self.ordering
+        ]
+        payload = json.dumps({'v': values, 'r': int(reverse)})
+        return replace_query_param(
+            self.base_url,
+            self.cursor_query_param,
+            urlsafe_b64encode(payload.encode()).decode()
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+        values, reverse = self.decode_cursor(request, queryset.model)
+        ordering = self.ordering
+        if reverse:
+            ordering = [self.invert(field) for field in ordering]
+        queryset = queryset.order_by(*ordering)
+        if values is not None:
+            queryset = queryset.filter(
+                self.get_keyset_filter(ordering, values)
+            )
+        results = list(queryset[:page_size + 1])
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = values is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, values is not None
+        self.page = results
+        return results
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
 
 
 class CustomPagination(PageNumberPagination):
+    """
+    Постраничная пагинация с параметрами page и limit.
+
+    Если задан keyset_ordering и в запросе есть параметр cursor
+    (для первой страницы пустой), используется KeysetPagination.
+    """
+
     page_size_query_param = 'limit'
+    keyset_ordering = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if (
+            self.keyset_ordering
+            and KeysetPagination.cursor_query_param in request.query_params
+        ):
+            self.keyset = KeysetPagination(self.keyset_ordering)
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class CachedCountPaginator(DjangoPaginator):
+    """Paginator, получающий количество записей через функцию get_count."""
+
+    def __init__(self, object_list, per_page, get_count, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.get_count = get_count
+
+    @cached_property
+    def count(self):
+        return self.get_count(self.object_list)
+
+
+class CachedCountPagination(CustomPagination):
+    """
+    Постраничная пагинация с кэшированием количества записей.
+
+    Количество хранится в кэше по нормализованному набору фильтров,
+    версии состава записей модели и версиям моделей из related_models,
+    от которых зависят фильтры. Изменения записей, не влияющие на их
+    состав, например счетчиков, кэш не сбрасывают. Фильтры
+    из user_filters зависят от пользователя и не кэшируются. Если задан
+    COUNT_ESTIMATE_THRESHOLD, для больших выборок в PostgreSQL вместо
+    COUNT(*) берется оценка числа строк планировщиком.
+    """
+
+    user_filters = ()
+    related_models = ()
+    ignored_params = ('page', 'limit', 'format')
+
+    def django_paginator_class(self, object_list, per_page):
+        return CachedCountPaginator(object_list, per_page, self.get_count)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_count_key(self, queryset):
+        params = self.request.query_params
+        if any(params.get(name) for name in self.user_filters):
+            return None
+        filters = sorted(
+            (name, sorted(params.getlist(name))) for name in params
+            if name not in self.ignored_params
+        )
+        model = queryset.model
+        versions = get_versions(
+            (model, ROWS_SCOPE),
+            *((related, None) for related in self.related_models)
+        )
+        digest = md5(json.dumps([filters, versions]).encode()).hexdigest()
+        return f'count:{model._meta.label_lower}:{digest}'
+
+    @staticmethod
+    def estimate_count(queryset):
+        """Оценка количества строк планировщиком PostgreSQL."""
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+    def count_queryset(self, queryset):
+        threshold = settings.COUNT_ESTIMATE_THRESHOLD
+        if threshold is not None:
+            estimate = self.estimate_count(queryset)
+            if estimate is not None and estimate > threshold:
+                return estimate
+        return queryset.count()
+
+    def get_count(self, queryset):
+        key = self.get_count_key(queryset)
+        if key is None:
+            return self.count_queryset(queryset)
+        count = caches['local'].get(key)
+        if count is None:
+            count = self.count_queryset(queryset)
+            caches['local'].set(key, count, settings.COUNT_CACHE_TIMEOUT)
+        return count
+
+
+class RecipePagination(CachedCountPagination):
+    keyset_ordering = ('-pub_date', '-id')
+    user_filters = ('is_favorited', 'is_in_shopping_cart')
+    related_models = (Tag,)
+
+
+class UserPagination(CustomPagination):
+    keyset_ordering = ('username', 'id')
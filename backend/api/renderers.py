@@ -0,0 +1,117 @@
+import csv
+from abc import ABCMeta, abstractmethod
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+from foodgram import constants
+
+
+class ShoppingListRenderer(BaseRenderer, metaclass=ABCMeta):
+    """
+    Базовый рендерер списка покупок.
+
+    Файл формируется генератором stream() по мере чтения строк из БД
+    и отдается через StreamingHttpResponse.
+    """
+
+    charset = 'utf-8'
+
+    def get_filename(self):
+        return f'list.{self.format}'
+
+    def get_content_type(self):
+        if self.charset:
+            return f'{self.media_type}; charset={self.charset}'
+        return self.media_type
+
+    @abstractmethod
+    def stream(self, ingredients):
+        """Части файла по строкам (название, единица, количество)."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """Ответы с ошибками отдаются в JSON, как в остальном API."""
+        response = (renderer_context or {}).get('response')
+        if response is None or response.status_code < 400:
+            raise NotImplementedError(
+                'Список покупок отдается через stream()'
+            )
+        renderer = JSONRenderer()
+        response['Content-Type'] = renderer.media_type
+        return renderer.render(data, renderer.media_type, renderer_context)
+
+
+class TextShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, ingredients):
+        for name, unit, total in ingredients:
+            yield f'{name}\t{total} {unit}\n'
+
+
+class Echo:
+    """Псевдо-буфер, возвращающий записанную строку для csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+class CsvShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, ingredients):
+        writer = csv.writer(Echo())
+        yield '\ufeff' + writer.writerow(
+            ('Ингредиент', 'Количество', 'Единица измерения')
+        )
+        for name, unit, total in ingredients:
+            yield writer.writerow((name, total, unit))
+
+
+class PdfShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+    font_name = 'ShoppingListFont'
+
+    def get_font(self):
+        if self.font_name not in pdfmetrics.getRegisteredFontNames():
+            pdfmetrics.registerFont(
+                TTFont(self.font_name, settings.SHOPPING_LIST_FONT)
+            )
+        return self.font_name
+
+    def stream(self, ingredients):
+        """
+        Документ рисуется постранично во временный файл, который
+        остается в памяти только пока он небольшой, и отдается частями.
+        """
+        with SpooledTemporaryFile(constants.PDF_SPOOL_SIZE) as file:
+            pdf = canvas.Canvas(file, pagesize=A4)
+            font = self.get_font()
+            _, height = A4
+            top = height - constants.PDF_MARGIN
+            y = top
+            pdf.setFont(font, constants.PDF_TITLE_SIZE)
+            pdf.drawString(constants.PDF_MARGIN, y, 'Список покупок')
+            y -= constants.PDF_LINE_HEIGHT * 2
+            pdf.setFont(font, constants.PDF_FONT_SIZE)
+            for name, unit, total in ingredients:
+                if y < constants.PDF_MARGIN:
+                    pdf.showPage()
+                    pdf.setFont(font, constants.PDF_FONT_SIZE)
+                    y = top
+                pdf.drawString(
+                    constants.PDF_MARGIN, y, f'{name} — {total} {unit}'
+                )
+                y -= constants.PDF_LINE_HEIGHT
+            pdf.save()
+            file.seek(0)
+            yield from iter(lambda: file.read(constants.PDF_CHUNK_SIZE), b'')
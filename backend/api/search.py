@@ -0,0 +1,65 @@
+from bisect import bisect_left
+from collections import defaultdict
+
+NGRAM_SIZE = 3
+
+
+class IngredientIndex:
+    """
+    Индекс для поиска ингредиентов по началу и вхождению названия.
+
+    Названия хранятся отсортированными в нижнем регистре: совпадения
+    по началу строки лежат в списке подряд и находятся бинарным поиском.
+    Для поиска вхождений используется инвертированный индекс триграмм.
+    Порядок выдачи совпадает с запросом к БД: сначала совпадения
+    по началу названия, затем по вхождению, каждая группа по алфавиту.
+    """
+
+    def __init__(self, items):
+        entries = sorted(
+            (name.casefold(), name, pk) for pk, name in items
+        )
+        self.keys = [key for key, _, _ in entries]
+        self.ids = [pk for _, _, pk in entries]
+        self.ngrams = defaultdict(set)
+        for position, key in enumerate(self.keys):
+            for ngram in self.get_ngrams(key):
+                self.ngrams[ngram].add(position)
+
+    @staticmethod
+    def get_ngrams(value):
+        return {
+            value[i:i + NGRAM_SIZE]
+            for i in range(len(value) - NGRAM_SIZE + 1)
+        }
+
+    def get_candidates(self, query):
+        """Позиции названий, которые могут содержать подстроку."""
+        if len(query) < NGRAM_SIZE:
+            return range(len(self.keys))
+        postings = sorted(
+            (self.ngrams.get(ngram, set()) for ngram in
+             self.get_ngrams(query)),
+            key=len
+        )
+        return sorted(set.intersection(*postings))
+
+    def search(self, query, limit=None):
+        """Возвращает id ингредиентов, подходящих под запрос."""
+        query = query.casefold()
+        result = []
+        position = bisect_left(self.keys, query)
+        while (
+            position < len(self.keys)
+            and self.keys[position].startswith(query)
+            and (limit is None or len(result) < limit)
+        ):
+            result.append(self.ids[position])
+            position += 1
+        for position in self.get_candidates(query):
+            if limit is not None and len(result) >= limit:
+                break
+            key = self.keys[position]
+            if query in key and not key.startswith(query):
+                result.append(self.ids[position])
+        return result
@@ -1,12 +1,32 @@
 import base64
 
 from django.core.files.base import ContentFile
+from django.db import IntegrityError, transaction
 from rest_framework import serializers
 
+from foodgram import constants
+from recipes import shopping_list
+from recipes.images import schedule_derivatives
 from recipes.models import Cart, Favorite, Ingredient, Quantity, Recipe, Tag
 from users.models import Follow, User
 
 
+def get_followed_authors(request):
+    """
+    Возвращает множество id авторов, на которых подписан пользователь.
+
+    Результат запоминается на объекте запроса, поэтому все сериализаторы
+    в рамках одного запроса выполняют не больше одного обращения к БД.
+    """
+    if not hasattr(request, 'followed_authors'):
+        request.followed_authors = set(
+            Follow.objects.filter(
+                user=request.user
+            ).values_list('author_id', flat=True)
+        )
+    return request.followed_authors
+
+
 class UserSerialiser(serializers.ModelSerializer):
     is_subscribed = serializers.SerializerMethodField()
 
@@ -22,31 +42,70 @@ class UserSerialiser(serializers.ModelSerializer):
         )
 
     def get_is_subscribed(self, obj):
+        is_subscribed = getattr(obj, 'is_subscribed', None)
+        if is_subscribed is not None:
+            return is_subscribed
         request = self.context.get('request')
         return bool(
             request and request.user.is_authenticated
-            and Follow.objects.filter(user=request.user, author=obj).exists()
+            and obj.id in get_followed_authors(request)
         )
 
 
 class AuthorReadSerializer(UserSerialiser):
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.ReadOnlyField(source='recipes.count')
 
     class Meta(UserSerialiser.Meta):
-        fields = UserSerialiser.Meta.fields + ('recipes', 'recipes_count')
+        fields = UserSerialiser.Meta.fields + (
+            'recipes',
+            'recipes_count',
+            'followers_count'
+        )
 
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        limit = request.query_params.get('recipes_limit')
-        recipes = obj.recipes.all()
-        if limit and limit.isdigit():
-            recipes = recipes[:int(limit)]
-        serializer = RecipeSummarySerializer(recipes, many=True,)
+        recipes = getattr(obj, 'limited_recipes', None)
+        if recipes is None:
+            request = self.context.get('request')
+            limit = request.query_params.get('recipes_limit')
+            recipes = obj.recipes.all()
+            if limit and limit.isdigit():
+                recipes = recipes[:int(limit)]
+        serializer = RecipeSummarySerializer(
+            recipes,
+            many=True,
+            context=self.context
+        )
         return serializer.data
 
 
-class FollowSerializer(serializers.ModelSerializer):
+class UniquePairSerializer(serializers.ModelSerializer):
+    """
+    Создает связь одним INSERT без предварительной проверки.
+
+    Нарушение уникальности, в том числе при одновременных запросах,
+    превращается в ошибку валидации с текстом unique_error.
+
+    Пользователь берется из запроса без обращения к БД. Второй объект
+    связи проверяется отдельным SELECT по первичному ключу: внешние
+    ключи проверяются только при фиксации транзакции, и без него
+    несуществующий id приводил бы к ошибке 500, а не 400.
+    """
+    user = serializers.HiddenField(default=serializers.CurrentUserDefault())
+    unique_error = None
+
+    def create(self, validated_data):
+        try:
+            with transaction.atomic():
+                return super().create(validated_data)
+        except IntegrityError:
+            if not self.Meta.model.objects.filter(**validated_data).exists():
+                raise
+            raise serializers.ValidationError({'errors': self.unique_error})
+
+
+class FollowSerializer(UniquePairSerializer):
+    unique_error = 'Вы уже подписаны на этого пользователя'
+
     class Meta:
         model = Follow
         fields = ('user', 'author')
@@ -56,10 +115,6 @@ class FollowSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError(
                 {'errors': 'Вы не можете подписаться на себя'}
             )
-        if Follow.objects.filter(**data).exists():
-            raise serializers.ValidationError(
-                {'errors': 'Вы уже подписаны на этого пользователя'}
-            )
         return data
 
     def to_representation(self, instance):
@@ -105,11 +160,21 @@ class QuantityWriteSerialier(serializers.ModelSerializer):
 
 
 class Base64ImageField(serializers.ImageField):
+    """Картинка в виде строки base64 или файла из multipart-формы."""
+
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
             format, imgstr = data.split(';base64,')
+            if len(imgstr) * 3 // 4 > constants.MAX_UPLOAD_SIZE:
+                raise serializers.ValidationError(
+                    'Размер файла превышает допустимый'
+                )
             ext = format.split('/')[-1]
             data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
+        elif getattr(data, 'size', 0) > constants.MAX_UPLOAD_SIZE:
+            raise serializers.ValidationError(
+                'Размер файла превышает допустимый'
+            )
 
         return super().to_internal_value(data)
 
@@ -135,30 +200,46 @@ class RecipeReadSerializer(serializers.ModelSerializer):
             'is_in_shopping_cart',
             'name',
             'image',
+            'image_webp',
+            'thumbnail',
             'text',
-            'cooking_time'
+            'cooking_time',
+            'favorites_count'
         )
 
-    def get_is_favorited(self, obj):
+    def get_user_flag(self, obj, flag, model):
+        """Берет флаг из аннотации queryset или запрашивает его из БД."""
+        value = getattr(obj, flag, None)
+        if value is not None:
+            return value
         request = self.context.get('request')
         return bool(
             request and request.user.is_authenticated
-            and Favorite.objects.filter(user=request.user, recipe=obj).exists()
+            and model.objects.filter(user=request.user, recipe=obj).exists()
         )
 
+    def get_is_favorited(self, obj):
+        return self.get_user_flag(obj, 'is_favorited', Favorite)
+
     def get_is_in_shopping_cart(self, obj):
-        request = self.context.get('request')
-        return bool(
-            request and request.user.is_authenticated
-            and Cart.objects.filter(user=request.user, recipe=obj).exists()
-        )
+        return self.get_user_flag(obj, 'is_in_shopping_cart', Cart)
 
 
 class RecipeSummarySerializer(serializers.ModelSerializer):
+    image = serializers.SerializerMethodField()
+
     class Meta:
         model = Recipe
         fields = ('id', 'name', 'image', 'cooking_time')
 
+    def get_image(self, obj):
+        """Для карточек отдается миниатюра, если она уже создана."""
+        image = obj.thumbnail or obj.image
+        request = self.context.get('request')
+        if request:
+            return request.build_absolute_uri(image.url)
+        return image.url
+
 
 class RecipeWriteSerializer(serializers.ModelSerializer):
     tags = serializers.PrimaryKeyRelatedField(
@@ -188,6 +269,7 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         ) for obj in ingredient_data]
         Quantity.objects.bulk_create(objects)
 
+    @transaction.atomic
     def create(self, validated_data):
         validated_data['author'] = self.context.get('request').user
         ingredients_data = validated_data.pop('ingredients')
@@ -195,15 +277,62 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         recipe = Recipe.objects.create(**validated_data)
         self.create_ingredients(ingredients_data, recipe)
         recipe.tags.add(*tags)
+        schedule_derivatives(recipe)
         return recipe
 
+    @staticmethod
+    def update_ingredients(ingredient_data, recipe):
+        """
+        Приводит ингредиенты рецепта к ingredient_data, меняя только
+        отличающиеся строки Quantity.
+
+        Возвращает id ингредиентов, количество которых изменилось.
+        """
+        amounts = {obj['id'].id: obj['amount'] for obj in ingredient_data}
+        current = {}
+        deleted = []
+        for quantity in recipe.recipe_ingredients.all():
+            if (
+                quantity.ingredient_id in amounts
+                and quantity.ingredient_id not in current
+            ):
+                current[quantity.ingredient_id] = quantity
+            else:
+                deleted.append(quantity)
+        changed = []
+        for ingredient_id, quantity in current.items():
+            if quantity.amount != amounts[ingredient_id]:
+                quantity.amount = amounts[ingredient_id]
+                changed.append(quantity)
+        created = [
+            Quantity(recipe=recipe, ingredient_id=pk, amount=amount)
+            for pk, amount in amounts.items() if pk not in current
+        ]
+        if deleted:
+            Quantity.objects.filter(
+                pk__in=[quantity.pk for quantity in deleted]
+            ).delete()
+        Quantity.objects.bulk_update(changed, ('amount',))
+        Quantity.objects.bulk_create(created)
+        return {
+            quantity.ingredient_id
+            for quantity in deleted + changed + created
+        }
+
+    @transaction.atomic
     def update(self, instance, validated_data):
-        ingredients = validated_data.pop('ingredients')
-        tags = validated_data.pop('tags')
-        instance.ingredients.clear()
-        self.create_ingredients(ingredients, instance)
-        instance.tags.set(tags)
-        return super().update(instance, validated_data)
+        ingredients = validated_data.pop('ingredients', None)
+        tags = validated_data.pop('tags', None)
+        if ingredients is not None:
+            ingredient_ids = self.update_ingredients(ingredients, instance)
+            if ingredient_ids:
+                shopping_list.refresh_recipe(instance.id, ingredient_ids)
+        if tags is not None:
+            instance.tags.set(tags)
+        recipe = super().update(instance, validated_data)
+        if 'image' in validated_data:
+            schedule_derivatives(recipe)
+        return recipe
 
     def to_representation(self, instance):
         serializer = RecipeReadSerializer(
@@ -236,6 +365,8 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         return value
 
     def validate(self, data):
+        if self.partial:
+            return data
         errors = {
             field: 'Обязательное поле' for field in
             ('ingredients', 'tags') if field not in data
@@ -245,18 +376,27 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         return data
 
 
-class FavoriteSerializer(serializers.ModelSerializer):
+class RecipeImageSerializer(serializers.ModelSerializer):
+    image = Base64ImageField()
+
+    class Meta:
+        model = Recipe
+        fields = ('image', 'image_webp', 'thumbnail')
+        read_only_fields = ('image_webp', 'thumbnail')
+
+    def update(self, instance, validated_data):
+        recipe = super().update(instance, validated_data)
+        schedule_derivatives(recipe)
+        return recipe
+
+
+class FavoriteSerializer(UniquePairSerializer):
+    unique_error = 'Вы уже добавляли этот рецепт'
+
     class Meta:
         fields = ('user', 'recipe')
         model = Favorite
 
-    def validate(self, data):
-        if self.Meta.model.objects.filter(**data).exists():
-            raise serializers.ValidationError(
-                {'errors': 'Вы уже добавляли этот рецепт'}
-            )
-        return data
-
     def to_representation(self, instance):
         serializer = RecipeSummarySerializer(
             instance.recipe,
@@ -265,6 +405,17 @@ class FavoriteSerializer(serializers.ModelSerializer):
         return serializer.data
 
 
+class RecipeBatchSerializer(serializers.Serializer):
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=constants.MAX_BATCH_SIZE
+    )
+
+    def validate_recipes(self, value):
+        return list(dict.fromkeys(value))
+
+
 class CartSerializer(FavoriteSerializer):
     class Meta(FavoriteSerializer.Meta):
         model = Cart
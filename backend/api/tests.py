@@ -0,0 +1,1359 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from base64 import b64encode, urlsafe_b64encode
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection, transaction
+from django.test import (SimpleTestCase, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
+from PIL import Image
+from rest_framework.test import APIClient
+
+from api.filters import IngredientFilter
+from api.search import IngredientIndex
+from api.serializers import RecipeWriteSerializer
+
+from foodgram import constants
+from recipes import counters, images, shopping_list
+from recipes.images import schedule_derivatives
+from recipes.models import (Cart, Favorite, Ingredient, Quantity, Recipe,
+                            ShoppingListItem, Tag)
+from recipes.versions import clear_local_versions
+from users.models import Follow, User
+
+LOCMEM_CACHES = {
+    alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+    for alias in ('default', 'local')
+}
+
+
+def clear_caches():
+    for alias in LOCMEM_CACHES:
+        caches[alias].clear()
+    clear_local_versions()
+
+
+def create_user(number):
+    return User.objects.create(
+        username=f'user{number}',
+        email=f'user{number}@example.com',
+        first_name='Имя',
+        last_name=f'Фамилия {number}',
+    )
+
+
+def create_tags(count):
+    return [
+        Tag.objects.create(
+            name=f'Тег {number}',
+            color=f'#{number:06X}',
+            slug=f'tag{number}'
+        )
+        for number in range(count)
+    ]
+
+
+def create_ingredients(count):
+    return Ingredient.objects.bulk_create(
+        Ingredient(name=f'Ингредиент {number}', measurement_unit='г')
+        for number in range(count)
+    )
+
+
+def create_recipes(authors, tags, ingredients, count, ingredients_count):
+    """Рецепты со всеми tags и ingredients_count ингредиентами."""
+    recipes = []
+    for number in range(count):
+        recipe = Recipe.objects.create(
+            name=f'Рецепт {number}',
+            author=authors[number % len(authors)],
+            image='recipe/images/test.png',
+            text='Описание',
+            cooking_time=10,
+        )
+        recipe.tags.set(tags)
+        Quantity.objects.bulk_create(
+            Quantity(recipe=recipe, ingredient=ingredient, amount=100)
+            for ingredient in ingredients[:ingredients_count]
+        )
+        recipes.append(recipe)
+    return recipes
+
+
+def create_png(size=(1, 1), mode='RGB', **params):
+    buffer = BytesIO()
+    Image.new(mode, size).save(buffer, 'PNG', **params)
+    return buffer.getvalue()
+
+
+def use_temp_media(test):
+    """Подменяет MEDIA_ROOT временным каталогом до конца теста."""
+    media = tempfile.TemporaryDirectory()
+    test.addCleanup(media.cleanup)
+    media_settings = override_settings(MEDIA_ROOT=media.name)
+    media_settings.enable()
+    test.addCleanup(media_settings.disable)
+    return media.name
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RecipeTestCase(TestCase):
+    """
+    Автор, теги, ингредиенты и RECIPES его рецептов со всеми тегами;
+    кэши очищаются перед каждым тестом.
+    """
+
+    TAGS = 1
+    INGREDIENTS = 1
+    RECIPES = 1
+    RECIPE_INGREDIENTS = 1
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user(1)
+        cls.tags = create_tags(cls.TAGS)
+        cls.ingredients = create_ingredients(cls.INGREDIENTS)
+        cls.recipes = create_recipes(
+            [cls.author], cls.tags, cls.ingredients,
+            cls.RECIPES, cls.RECIPE_INGREDIENTS
+        )
+        cls.recipe = next(iter(cls.recipes), None)
+
+    def setUp(self):
+        clear_caches()
+
+
+class RecipeQueryCountTest(RecipeTestCase):
+    """
+    Число запросов к БД на список и карточку рецепта не зависит
+    от размера страницы и числа ингредиентов в рецептах.
+    """
+
+    ANONYMOUS_LIST_QUERIES = 5
+    USER_LIST_QUERIES = 6
+    ANONYMOUS_DETAIL_QUERIES = 4
+    USER_DETAIL_QUERIES = 5
+    TAGS = 3
+    INGREDIENTS = 10
+    RECIPES = 0
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = create_user(0)
+        authors = [cls.author, create_user(2), create_user(3)]
+        cls.few_ingredients = create_recipes(
+            authors, cls.tags, cls.ingredients, 10, 1
+        )
+        cls.many_ingredients = create_recipes(
+            authors, cls.tags, cls.ingredients, 10, 10
+        )
+        for recipe in cls.few_ingredients[:5] + cls.many_ingredients[:5]:
+            Favorite.objects.create(user=cls.user, recipe=recipe)
+            Cart.objects.create(user=cls.user, recipe=recipe)
+        Follow.objects.create(user=cls.user, author=authors[0])
+
+    def setUp(self):
+        super().setUp()
+        self.anonymous = APIClient()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assert_queries(self, client, url, expected):
+        clear_caches()
+        with self.assertNumQueries(expected):
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_list(self):
+        for name, client, expected in (
+            ('anonymous', self.anonymous, self.ANONYMOUS_LIST_QUERIES),
+            ('user', self.client, self.USER_LIST_QUERIES),
+        ):
+            # Первая страница по 10 - рецепты с 10 ингредиентами,
+            # вторая - с одним, по 20 - и те и другие.
+            for params, size in (
+                ('limit=1', 1),
+                ('limit=10', 10),
+                ('page=2&limit=10', 10),
+                ('limit=20', 20),
+            ):
+                with self.subTest(name, params=params):
+                    response = self.assert_queries(
+                        client, f'/api/recipes/?{params}', expected
+                    )
+                    self.assertEqual(len(response.data['results']), size)
+
+    def test_detail(self):
+        for name, client, expected in (
+            ('anonymous', self.anonymous, self.ANONYMOUS_DETAIL_QUERIES),
+            ('user', self.client, self.USER_DETAIL_QUERIES),
+        ):
+            for recipe in (self.few_ingredients[0], self.many_ingredients[0]):
+                with self.subTest(name, recipe=recipe.name):
+                    response = self.assert_queries(
+                        client, f'/api/recipes/{recipe.id}/', expected
+                    )
+                    self.assertEqual(
+                        len(response.data['ingredients']),
+                        recipe.recipe_ingredients.count()
+                    )
+
+
+class SubscriptionsQueryCountTest(RecipeTestCase):
+    """
+    Число запросов к БД на список подписок не зависит от числа авторов
+    и их рецептов, а recipes_limit ограничивает рецепты каждого автора.
+    """
+
+    SUBSCRIPTIONS_QUERIES = 3
+    RECIPES = 0
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = create_user(0)
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def follow(self, first_number, authors_count, recipes_count):
+        authors = [
+            create_user(number)
+            for number in range(first_number, first_number + authors_count)
+        ]
+        for author in authors:
+            Follow.objects.create(user=self.user, author=author)
+            create_recipes(
+                [author], self.tags, self.ingredients, recipes_count, 1
+            )
+
+    def test_recipes_limit(self):
+        for first_number, authors_count, recipes_count in (
+            (10, 1, 1),
+            (20, 5, 3),
+            (30, 4, 6),
+        ):
+            self.follow(first_number, authors_count, recipes_count)
+            with self.subTest(authors=authors_count, recipes=recipes_count):
+                clear_caches()
+                with self.assertNumQueries(self.SUBSCRIPTIONS_QUERIES):
+                    response = self.client.get(
+                        '/api/users/subscriptions/?recipes_limit=2&limit=100'
+                    )
+                self.assertEqual(response.status_code, 200)
+                authors = response.data['results']
+                self.assertEqual(len(authors), response.data['count'])
+                for author in authors:
+                    self.assertEqual(
+                        len(author['recipes']),
+                        min(author['recipes_count'], 2)
+                    )
+
+
+class CatalogCacheTest(TestCase):
+    """
+    Теги и ингредиенты отдаются из памяти процесса без запросов
+    к БД, в том числе к общему кэшу в таблице django_cache.
+    """
+
+    def setUp(self):
+        caches['default'].clear()
+        clear_local_versions()
+        self.tag, = create_tags(1)
+        create_ingredients(1)
+        self.client = APIClient()
+
+    def test_warm_catalog(self):
+        for url in (
+            '/api/tags/',
+            f'/api/tags/{self.tag.id}/',
+            '/api/ingredients/',
+            '/api/ingredients/?name=инг',
+        ):
+            with self.subTest(url=url):
+                etag = self.client.get(url)['ETag']
+                with self.assertNumQueries(0):
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                with self.assertNumQueries(0):
+                    response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+
+    def test_change_in_process(self):
+        self.client.get('/api/tags/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tag.name = 'Новый тег'
+            self.tag.save()
+        response = self.client.get('/api/tags/')
+        self.assertEqual(response.data[0]['name'], 'Новый тег')
+
+
+class IngredientIndexTest(SimpleTestCase):
+
+    def setUp(self):
+        self.index = IngredientIndex(
+            [(pk, f'соль {pk:03}') for pk in range(300)]
+            + [(300, 'морская соль'), (301, 'сахар')]
+        )
+
+    def test_prefix_before_substring(self):
+        self.assertEqual(self.index.search('СОЛЬ 00'), list(range(10)))
+        self.assertEqual(self.index.search('ская'), [300])
+        self.assertEqual(self.index.search('соль')[-1], 300)
+
+    def test_limit(self):
+        self.assertEqual(self.index.search('с', 3), [301, 0, 1])
+        self.assertEqual(self.index.search('соль', 0), [])
+        self.assertEqual(len(self.index.search('соль', 301)), 301)
+
+
+class TrigramSearchTest(TestCase):
+
+    def setUp(self):
+        if connection.vendor != 'postgresql':
+            self.skipTest('pg_trgm есть только в PostgreSQL')
+        Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit='г')
+            for name in ('Sea salt', 'Salt', 'Sugar', 'Potatoes')
+        )
+
+    def search(self, value):
+        return list(IngredientFilter.filter_name_trigram(
+            Ingredient.objects.all(), value
+        ).values_list('name', flat=True))
+
+    def test_prefix_before_substring(self):
+        self.assertEqual(self.search('sal'), ['Salt', 'Sea salt'])
+
+    def test_typo(self):
+        self.assertEqual(self.search('potatos'), ['Potatoes'])
+
+
+class ShoppingListDownloadTest(RecipeTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Cart.objects.create(user=cls.author, recipe=cls.recipe)
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    def download(self, query='', **headers):
+        response = self.client.get(
+            f'/api/recipes/download_shopping_cart/{query}', **headers
+        )
+        self.assertEqual(response.status_code, 200)
+        return response['Content-Type'], b''.join(response.streaming_content)
+
+    def test_formats(self):
+        text = 'Ингредиент 0\t100 г\n'.encode()
+        for query, headers, content_type in (
+            ('', {}, 'text/plain; charset=utf-8'),
+            ('?format=csv', {}, 'text/csv; charset=utf-8'),
+            ('', {'HTTP_ACCEPT': 'text/csv'}, 'text/csv; charset=utf-8'),
+            (
+                '',
+                {'HTTP_ACCEPT': 'application/json'},
+                'text/plain; charset=utf-8'
+            ),
+        ):
+            with self.subTest(query=query, headers=headers):
+                self.assertEqual(
+                    self.download(query, **headers)[0], content_type
+                )
+        self.assertEqual(
+            self.download(HTTP_ACCEPT='application/json')[1], text
+        )
+
+    def test_pdf(self):
+        if not os.path.exists(settings.SHOPPING_LIST_FONT):
+            self.skipTest('Нет шрифта для PDF')
+        content_type, content = self.download('?format=pdf')
+        self.assertEqual(content_type, 'application/pdf')
+        self.assertTrue(content.startswith(b'%PDF'))
+
+    def test_errors_as_json(self):
+        for query in ('', '?format=csv', '?format=pdf'):
+            with self.subTest(query=query):
+                response = APIClient().get(
+                    f'/api/recipes/download_shopping_cart/{query}'
+                )
+                self.assertEqual(response.status_code, 401)
+                self.assertEqual(response['Content-Type'], 'application/json')
+                self.assertIn('detail', response.json())
+        response = self.client.get(
+            '/api/recipes/download_shopping_cart/?format=xml'
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+
+class ShoppingListTest(RecipeTestCase):
+    """Список покупок обновляется вместе с корзиной и рецептами в ней."""
+
+    INGREDIENTS = 3
+    RECIPES = 2
+    RECIPE_INGREDIENTS = 2
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = create_user(0)
+        cls.first, cls.second = cls.recipes
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.author_client = APIClient()
+        self.author_client.force_authenticate(self.author)
+
+    def get_list(self):
+        return dict(ShoppingListItem.objects.filter(
+            user=self.user
+        ).values_list('ingredient', 'total'))
+
+    def add_to_cart(self, recipe):
+        response = self.client.post(
+            f'/api/recipes/{recipe.id}/shopping_cart/'
+        )
+        self.assertEqual(response.status_code, 201)
+
+    def test_cart(self):
+        first, second, _ = (obj.id for obj in self.ingredients)
+        self.add_to_cart(self.first)
+        self.assertEqual(self.get_list(), {first: 100, second: 100})
+        self.add_to_cart(self.second)
+        self.assertEqual(self.get_list(), {first: 200, second: 200})
+        response = self.client.delete(
+            f'/api/recipes/{self.first.id}/shopping_cart/'
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.get_list(), {first: 100, second: 100})
+        response = self.author_client.delete(
+            f'/api/recipes/{self.second.id}/'
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.get_list(), {})
+
+    def test_ingredient_edit(self):
+        first, second, third = (obj.id for obj in self.ingredients)
+        self.add_to_cart(self.first)
+        self.add_to_cart(self.second)
+        response = self.author_client.patch(
+            f'/api/recipes/{self.first.id}/',
+            {'ingredients': [
+                {'id': first, 'amount': 30},
+                {'id': third, 'amount': 5},
+            ]},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            self.get_list(), {first: 130, second: 100, third: 5}
+        )
+        self.client.delete(f'/api/recipes/{self.second.id}/shopping_cart/')
+        self.assertEqual(self.get_list(), {first: 30, third: 5})
+
+    def test_cart_reassigned(self):
+        """Переназначение корзины в админке переносит ингредиенты."""
+        first, second, _ = (obj.id for obj in self.ingredients)
+        other = create_user(2)
+        self.add_to_cart(self.first)
+        cart = Cart.objects.get(user=self.user)
+        Quantity.objects.filter(
+            recipe=self.second, ingredient=second
+        ).update(amount=40)
+        cart.recipe = self.second
+        cart.save()
+        self.assertEqual(self.get_list(), {first: 100, second: 40})
+        cart.user = other
+        cart.save()
+        self.assertEqual(self.get_list(), {})
+        self.assertEqual(
+            dict(other.shopping_list.values_list('ingredient', 'total')),
+            {first: 100, second: 40}
+        )
+        cart.delete()
+        self.assertFalse(ShoppingListItem.objects.exists())
+
+    def test_stale_list_not_negative(self):
+        self.add_to_cart(self.first)
+        ShoppingListItem.objects.update(total=1)
+        response = self.client.delete(
+            f'/api/recipes/{self.first.id}/shopping_cart/'
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.get_list(), {})
+
+
+class BatchTest(RecipeTestCase):
+
+    RECIPES = 3
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = create_user(0)
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def batch(self, method, action, ids):
+        response = getattr(self.client, method)(
+            f'/api/recipes/{action}/batch/', {'recipes': ids}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        return {
+            obj['id']: obj.get('result', obj.get('errors'))
+            for obj in response.data
+        }
+
+    def test_favorites(self):
+        first, second, third = (recipe.id for recipe in self.recipes)
+        Favorite.objects.create(user=self.user, recipe=self.recipes[0])
+        self.assertEqual(
+            self.batch('post', 'favorite', [first, second, 10 ** 6]),
+            {
+                first: 'Вы уже добавляли этот рецепт',
+                second: 'added',
+                10 ** 6: 'Рецепт не найден',
+            }
+        )
+        self.assertEqual(
+            self.batch('delete', 'favorite', [second, third]),
+            {second: 'removed', third: 'Вы не добавляли этот рецепт'}
+        )
+        self.assertEqual(
+            list(Recipe.objects.order_by('id').values_list(
+                'favorites_count', flat=True
+            )),
+            [1, 0, 0]
+        )
+
+    def test_shopping_cart(self):
+        ids = [recipe.id for recipe in self.recipes]
+        self.batch('post', 'shopping_cart', ids)
+        self.assertEqual(
+            list(ShoppingListItem.objects.values_list('total', flat=True)),
+            [300]
+        )
+        self.batch('delete', 'shopping_cart', ids[:2])
+        self.assertEqual(
+            list(ShoppingListItem.objects.values_list('total', flat=True)),
+            [100]
+        )
+
+
+class KeysetPaginationTest(RecipeTestCase):
+
+    RECIPES = 11
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        # Пять рецептов с одной датой публикации, остальные парами,
+        # так что границы страниц попадают внутрь совпадающих дат.
+        now = timezone.now()
+        for number, recipe in enumerate(cls.recipes):
+            recipe.pub_date = now - timedelta(minutes=max(number - 3, 0) // 2)
+        Recipe.objects.bulk_update(cls.recipes, ('pub_date',))
+
+    def walk(self, url, link):
+        """Id рецептов на страницах по ссылкам link, начиная с url."""
+        pages = []
+        while url:
+            response = APIClient().get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([recipe['id'] for recipe in response.data['results']])
+            url = response.data[link]
+        return pages, response.data
+
+    def test_walk(self):
+        expected = list(Recipe.objects.order_by(
+            '-pub_date', '-id'
+        ).values_list('id', flat=True))
+        pages, last = self.walk('/api/recipes/?cursor=&limit=3', 'next')
+        self.assertEqual([len(page) for page in pages], [3, 3, 3, 2])
+        self.assertEqual(sum(pages, []), expected)
+        pages, first = self.walk(last['previous'], 'previous')
+        self.assertEqual(sum(reversed(pages), []), expected[:-2])
+        self.assertIsNotNone(first['next'])
+
+    def test_invalid_cursor(self):
+        client = APIClient()
+        for payload in (
+            'not-base64',
+            '{"v": ["x", "y"], "r": 0}',
+            '{"v": [], "r": 0}',
+            '[]',
+        ):
+            with self.subTest(payload=payload):
+                cursor = urlsafe_b64encode(payload.encode()).decode()
+                response = client.get(f'/api/recipes/?cursor={cursor}')
+                self.assertEqual(response.status_code, 404)
+
+
+class AuthorInvalidationTest(RecipeTestCase):
+    """Кэш рецептов сбрасывается только при изменении данных автора."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.author.set_password('author-password')
+        cls.author.save()
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+
+    def get_etag(self):
+        response = self.client.get('/api/recipes/')
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def test_login_keeps_etag(self):
+        etag = self.get_etag()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/auth/token/login/', {
+                'email': self.author.email,
+                'password': 'author-password',
+            })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_etag(), etag)
+        response = self.client.get('/api/recipes/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_author_change_updates_etag(self):
+        etag = self.get_etag()
+        self.author.last_name = 'Новая фамилия'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.save()
+        self.assertNotEqual(self.get_etag(), etag)
+        response = self.client.get('/api/recipes/')
+        self.assertEqual(
+            response.data['results'][0]['author']['last_name'],
+            'Новая фамилия'
+        )
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class UniquePairConcurrencyTest(TransactionTestCase):
+    """Одновременные запросы на одну и ту же связь создают одну запись."""
+
+    THREADS = 8
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('Потокам нужна общая БД в файле или на сервере')
+        clear_caches()
+        self.user = create_user(0)
+        self.author = create_user(1)
+        self.recipe, = create_recipes(
+            [self.author], create_tags(1), create_ingredients(1), 1, 1
+        )
+
+    def post_concurrently(self, url):
+        """Отправляет POST из нескольких потоков одновременно."""
+        barrier = threading.Barrier(self.THREADS)
+        statuses = []
+
+        def post():
+            client = APIClient()
+            client.force_authenticate(self.user)
+            try:
+                barrier.wait()
+                statuses.append(client.post(url).status_code)
+            except Exception as error:
+                statuses.append(repr(error))
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=post) for _ in range(self.THREADS)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return sorted(statuses, key=str)
+
+    def test_pairs(self):
+        expected = [201] + [400] * (self.THREADS - 1)
+        for model, url, filters in (
+            (
+                Cart,
+                f'/api/recipes/{self.recipe.id}/shopping_cart/',
+                {'recipe': self.recipe},
+            ),
+            (
+                Favorite,
+                f'/api/recipes/{self.recipe.id}/favorite/',
+                {'recipe': self.recipe},
+            ),
+            (
+                Follow,
+                f'/api/users/{self.author.id}/subscribe/',
+                {'author': self.author},
+            ),
+        ):
+            with self.subTest(model=model.__name__):
+                self.assertEqual(self.post_concurrently(url), expected)
+                self.assertEqual(
+                    model.objects.filter(user=self.user, **filters).count(),
+                    1
+                )
+        self.assertEqual(
+            list(ShoppingListItem.objects.filter(
+                user=self.user
+            ).values_list('total', flat=True)),
+            [100]
+        )
+        self.recipe.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 1)
+        self.assertEqual(self.author.followers_count, 1)
+
+
+class RecipeEtagTest(RecipeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.url = f'/api/recipes/{self.recipe.id}/'
+        self.client = APIClient()
+
+    def test_favorite_changes_etag(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['favorites_count'], 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            Favorite.objects.create(user=create_user(2), recipe=self.recipe)
+        response = self.client.get(
+            self.url, HTTP_IF_NONE_MATCH=response['ETag']
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['favorites_count'], 1)
+
+    def test_favorite_keeps_list_cache(self):
+        response = self.client.get('/api/recipes/')
+        etag = response['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Favorite.objects.create(user=create_user(2), recipe=self.recipe)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                '/api/recipes/', HTTP_IF_NONE_MATCH=etag
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['favorites_count'], 1)
+        self.assertEqual(len(queries), 1)
+        self.assertIn('favorites_count', queries[0]['sql'])
+
+    def test_new_recipe_changes_count(self):
+        self.assertEqual(self.client.get('/api/recipes/').data['count'], 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            create_recipes(
+                [self.recipe.author], self.recipe.tags.all(), [], 1, 0
+            )
+        self.assertEqual(self.client.get('/api/recipes/').data['count'], 2)
+
+    def test_no_last_modified(self):
+        """Изменение тега меняет ответ, даже если рецепт не менялся."""
+        response = self.client.get(self.url)
+        self.assertNotIn('Last-Modified', response)
+        tag = self.recipe.tags.get()
+        tag.name = 'Новый тег'
+        with self.captureOnCommitCallbacks(execute=True):
+            tag.save()
+        response = self.client.get(
+            self.url,
+            HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60)
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['tags'][0]['name'], 'Новый тег')
+
+
+class RecipeUpdateTest(RecipeTestCase):
+    """PATCH меняет только отличающиеся строки ингредиентов и тегов."""
+
+    TAGS = 2
+    INGREDIENTS = 4
+    RECIPE_INGREDIENTS = 3
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.recipe.tags.set(cls.tags[:1])
+        cls.buyer = create_user(2)
+        Cart.objects.create(user=cls.buyer, recipe=cls.recipe)
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+        self.url = f'/api/recipes/{self.recipe.id}/'
+
+    def get_quantities(self):
+        quantities = self.recipe.recipe_ingredients.values_list(
+            'pk', 'ingredient', 'amount'
+        )
+        return {
+            ingredient: (pk, amount) for pk, ingredient, amount in quantities
+        }
+
+    def test_ingredients_diff(self):
+        same, changed, deleted, created = (
+            obj.id for obj in self.ingredients
+        )
+        before = self.get_quantities()
+        response = self.client.patch(self.url, {'ingredients': [
+            {'id': same, 'amount': 100},
+            {'id': changed, 'amount': 50},
+            {'id': created, 'amount': 7},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        after = self.get_quantities()
+        self.assertEqual(after.keys(), {same, changed, created})
+        self.assertEqual(after[same], before[same])
+        self.assertEqual(after[changed], (before[changed][0], 50))
+        self.assertEqual(after[created][1], 7)
+        self.assertFalse(Quantity.objects.filter(pk=before[deleted][0]))
+        self.assertEqual(
+            dict(self.buyer.shopping_list.values_list('ingredient', 'total')),
+            {same: 100, changed: 50, created: 7}
+        )
+        self.assertEqual(
+            list(self.recipe.tags.values_list('id', flat=True)),
+            [self.tags[0].id]
+        )
+
+    def test_unchanged_ingredients(self):
+        before = self.get_quantities()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(self.url, {
+                'ingredients': [
+                    {'id': ingredient, 'amount': amount}
+                    for ingredient, (_, amount) in before.items()
+                ],
+                'tags': [tag.id for tag in self.tags],
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_quantities(), before)
+        self.assertEqual(len(response.data['tags']), 2)
+        self.assertFalse([
+            query for query in queries.captured_queries
+            if 'recipes_quantity' in query['sql']
+            and not query['sql'].startswith('SELECT')
+        ])
+
+
+class CounterSaveTest(RecipeTestCase):
+    """save() устаревшего объекта не затирает счетчики."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = create_user(2)
+
+    def test_recipe_update(self):
+        stale = Recipe.objects.get(pk=self.recipe.pk)
+        Favorite.objects.create(user=self.user, recipe=self.recipe)
+        serializer = RecipeWriteSerializer(
+            stale,
+            data={'name': 'Новое название'},
+            partial=True,
+            context={'request': None}
+        )
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.name, 'Новое название')
+        self.assertEqual(self.recipe.favorites_count, 1)
+
+    def test_user_save(self):
+        stale = User.objects.get(pk=self.author.pk)
+        Follow.objects.create(user=self.user, author=self.author)
+        stale.first_name = 'Новое имя'
+        stale.save()
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.first_name, 'Новое имя')
+        self.assertEqual(self.author.followers_count, 1)
+        self.assertEqual(self.author.recipes_count, 1)
+
+    def test_reassigned_links(self):
+        """Переназначение связей в админке переносит счетчики."""
+        other_recipe, = create_recipes(
+            [self.user], self.tags, self.ingredients, 1, 1
+        )
+        favorite = Favorite.objects.create(user=self.user, recipe=self.recipe)
+        favorite.recipe = other_recipe
+        favorite.save()
+        follow = Follow.objects.create(user=self.author, author=self.user)
+        follow.author = self.author
+        follow.user = self.user
+        follow.save()
+        self.recipe.author = self.user
+        self.recipe.save()
+        for obj, field, expected in (
+            (self.recipe, 'favorites_count', 0),
+            (other_recipe, 'favorites_count', 1),
+            (self.author, 'followers_count', 1),
+            (self.user, 'followers_count', 0),
+            (self.author, 'recipes_count', 0),
+            (self.user, 'recipes_count', 2),
+        ):
+            obj.refresh_from_db()
+            with self.subTest(obj=str(obj), field=field):
+                self.assertEqual(getattr(obj, field), expected)
+
+
+class RecipeCreateTest(RecipeTestCase):
+
+    RECIPES = 0
+
+    def test_failed_create_keeps_counter(self):
+        author = self.author
+        tag, = self.tags
+        ingredient, = self.ingredients
+        client = APIClient()
+        client.force_authenticate(author)
+        use_temp_media(self)
+        with mock.patch.object(
+            RecipeWriteSerializer,
+            'create_ingredients',
+            side_effect=DatabaseError
+        ), self.assertRaises(DatabaseError):
+            client.post('/api/recipes/', {
+                'ingredients': [{'id': ingredient.id, 'amount': 10}],
+                'tags': [tag.id],
+                'image': 'data:image/png;base64,'
+                + b64encode(create_png()).decode(),
+                'name': 'Рецепт',
+                'text': 'Описание',
+                'cooking_time': 10,
+            }, format='json')
+        author.refresh_from_db()
+        self.assertFalse(Recipe.objects.exists())
+        self.assertEqual(author.recipes_count, 0)
+
+
+@override_settings(IMAGE_WORKERS=0)
+class RecipeUploadTest(RecipeTestCase):
+    """Картинка загружается файлом из multipart-формы или строкой base64."""
+
+    def setUp(self):
+        super().setUp()
+        self.media = use_temp_media(self)
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+        self.image_url = f'/api/recipes/{self.recipe.id}/image/'
+
+    def get_file(self, size=(1, 1)):
+        return SimpleUploadedFile('test.png', create_png(size), 'image/png')
+
+    def get_media_files(self):
+        return sorted(
+            os.path.join(path, name)
+            for path, _, names in os.walk(self.media) for name in names
+        )
+
+    def test_multipart_create(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/recipes/', {
+                'ingredients[0]id': self.ingredients[0].id,
+                'ingredients[0]amount': 10,
+                'tags': [self.tags[0].id],
+                'image': self.get_file(),
+                'name': 'Рецепт',
+                'text': 'Описание',
+                'cooking_time': 10,
+            }, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['ingredients'][0]['amount'], 10)
+        recipe = Recipe.objects.get(pk=response.data['id'])
+        self.assertTrue(recipe.image.name.endswith('.png'))
+        self.assertTrue(recipe.image_webp)
+        self.assertTrue(recipe.thumbnail)
+
+    def test_image_patch(self):
+        for name, data, format in (
+            ('multipart', {'image': self.get_file()}, 'multipart'),
+            (
+                'base64',
+                {'image': 'data:image/png;base64,'
+                 + b64encode(create_png()).decode()},
+                'json',
+            ),
+        ):
+            with self.subTest(name):
+                with self.captureOnCommitCallbacks(execute=True):
+                    response = self.client.patch(
+                        self.image_url, data, format=format
+                    )
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(
+                    response.data.keys(), {'image', 'image_webp', 'thumbnail'}
+                )
+                self.recipe.refresh_from_db()
+                self.assertTrue(
+                    response.data['image'].endswith(self.recipe.image.name)
+                )
+                self.assertTrue(self.recipe.image_webp)
+
+    def test_too_large_upload(self):
+        """Превышение размера дает 413 и не оставляет файлов."""
+        upload_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(upload_dir.cleanup)
+        media_files = self.get_media_files()
+        for name, memory_size in (
+            ('Content-Length', 0),
+            ('chunks', settings.DATA_UPLOAD_MAX_MEMORY_SIZE),
+        ):
+            with self.subTest(name), mock.patch.object(
+                constants, 'MAX_UPLOAD_SIZE', 100
+            ), override_settings(
+                DATA_UPLOAD_MAX_MEMORY_SIZE=memory_size,
+                FILE_UPLOAD_TEMP_DIR=upload_dir.name,
+            ):
+                response = self.client.patch(
+                    self.image_url,
+                    {'image': self.get_file((1000, 1000))},
+                    format='multipart'
+                )
+                self.assertEqual(response.status_code, 413)
+                self.assertEqual(os.listdir(upload_dir.name), [])
+                self.assertEqual(self.get_media_files(), media_files)
+
+    @mock.patch.object(constants, 'MAX_UPLOAD_SIZE', 100)
+    def test_too_large_base64(self):
+        response = self.client.patch(self.image_url, {
+            'image': 'data:image/png;base64,'
+            + b64encode(create_png((1000, 1000))).decode()
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('image', response.data)
+        self.assertEqual(self.get_media_files(), [])
+
+
+@override_settings(IMAGE_WORKERS=0)
+class ImageDerivativesTest(RecipeTestCase):
+
+    def setUp(self):
+        super().setUp()
+        use_temp_media(self)
+
+    def set_image(self, content):
+        self.recipe.image.save('test.png', ContentFile(content), save=False)
+
+    def test_transparent_palette(self):
+        self.set_image(create_png((2000, 1000), 'P', transparency=0))
+        with self.captureOnCommitCallbacks() as callbacks:
+            schedule_derivatives(self.recipe)
+        self.assertFalse(self.recipe.image_webp)
+        for callback in callbacks:
+            callback()
+        self.recipe.refresh_from_db()
+        for field, size in (
+            ('image_webp', (1280, 640)),
+            ('thumbnail', (400, 200)),
+        ):
+            with self.subTest(field=field):
+                with getattr(self.recipe, field).open('rb') as file:
+                    image = Image.open(file)
+                    self.assertEqual(image.format, 'WEBP')
+                    self.assertEqual(image.mode, 'RGBA')
+                    self.assertEqual(image.size, size)
+
+    def test_broken_image_logged(self):
+        self.set_image(b'not an image')
+        with self.assertLogs('recipes.images', 'ERROR'):
+            with self.captureOnCommitCallbacks(execute=True):
+                schedule_derivatives(self.recipe)
+        self.recipe.refresh_from_db()
+        self.assertFalse(self.recipe.image_webp)
+
+    @override_settings(IMAGE_WORKERS=2)
+    def test_pool(self):
+        done = threading.Event()
+        threads = []
+
+        def process_recipe(recipe_id):
+            threads.append((recipe_id, threading.current_thread().name))
+            done.set()
+
+        with mock.patch.object(images, 'process_recipe', process_recipe):
+            with self.captureOnCommitCallbacks(execute=True):
+                schedule_derivatives(self.recipe)
+            self.assertTrue(done.wait(5))
+            (recipe_id, thread), = threads
+            self.assertEqual(recipe_id, self.recipe.id)
+            self.assertTrue(thread.startswith('recipe-images'))
+            threads.clear()
+            full = threading.BoundedSemaphore(1)
+            full.acquire()
+            with mock.patch.object(images, '_slots', full):
+                images.submit(self.recipe.id)
+        self.assertEqual(
+            threads, [(self.recipe.id, threading.current_thread().name)]
+        )
+
+
+class CreateImageDerivativesCommandTest(RecipeTestCase):
+
+    RECIPES = 2
+
+    def setUp(self):
+        super().setUp()
+        use_temp_media(self)
+        for recipe in self.recipes:
+            recipe.image.save('test.png', ContentFile(create_png()))
+
+    def create_derivatives(self):
+        stdout = StringIO()
+        call_command('create_image_derivatives', stdout=stdout)
+        return stdout.getvalue()
+
+    def get_derivatives(self):
+        return list(Recipe.objects.order_by('id').values_list(
+            'image_webp', 'thumbnail'
+        ))
+
+    def test_missing_only(self):
+        self.assertEqual(self.get_derivatives(), [('', '')] * 2)
+        self.assertIn('для 2 рецептов', self.create_derivatives())
+        derivatives = self.get_derivatives()
+        for image_webp, thumbnail in derivatives:
+            self.assertTrue(image_webp.endswith('.webp'))
+            self.assertTrue(thumbnail.endswith('.webp'))
+        self.assertIn('для 0 рецептов', self.create_derivatives())
+        self.assertEqual(self.get_derivatives(), derivatives)
+
+
+class ImportDataTest(TestCase):
+
+    TAGS = [
+        {'name': 'Завтрак днем', 'color': '#000001', 'slug': 'breakfast'},
+        {'name': 'Обед', 'color': '#000002', 'slug': 'dinner'},
+        {'name': 'Ужин', 'color': '#00FF00', 'slug': 'supper'},
+        {'name': 'Полдник', 'color': '#000003', 'slug': 'snack'},
+    ]
+
+    def setUp(self):
+        clear_local_versions()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        Tag.objects.bulk_create([
+            Tag(name='Завтрак', color='#FF0000', slug='breakfast'),
+            Tag(name='Обед', color='#00FF00', slug='lunch'),
+        ])
+
+    def import_data(self, name, content, **options):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        stderr = StringIO()
+        call_command(
+            'import_data', path, stdout=StringIO(), stderr=stderr, **options
+        )
+        return stderr.getvalue()
+
+    def assert_tags_upserted(self, copy):
+        stderr = self.import_data(
+            'tags.json', json.dumps(self.TAGS),
+            model='tags', mode='upsert', copy=copy
+        )
+        self.assertIn('уникальным полям: 2', stderr)
+        self.assertEqual(
+            list(Tag.objects.order_by('slug').values_list(
+                'slug', 'name', 'color'
+            )),
+            [
+                ('breakfast', 'Завтрак днем', '#000001'),
+                ('lunch', 'Обед', '#00FF00'),
+                ('snack', 'Полдник', '#000003'),
+            ]
+        )
+
+    def test_upsert_bulk_create(self):
+        self.assert_tags_upserted(copy=False)
+
+    def test_upsert_copy(self):
+        if connection.vendor != 'postgresql':
+            self.skipTest('COPY есть только в PostgreSQL')
+        self.assert_tags_upserted(copy=True)
+
+    def test_upsert_without_update_fields(self):
+        Ingredient.objects.create(name='соль', measurement_unit='г')
+        stderr = self.import_data(
+            'ingredients.csv', 'name,measurement_unit\nсоль,г\nсахар,г\n',
+            mode='upsert'
+        )
+        self.assertIn('входят в ключ', stderr)
+        self.assertEqual(
+            list(Ingredient.objects.order_by('name').values_list(
+                'name', flat=True
+            )),
+            ['сахар', 'соль']
+        )
+
+
+class GenerateDatasetTest(RecipeTestCase):
+
+    TAGS = 3
+    INGREDIENTS = 10
+    RECIPES = 0
+
+    def test_small_dataset(self):
+        use_temp_media(self)
+        options = {
+            'users': 5,
+            'recipes': 20,
+            'min_ingredients': 2,
+            'max_ingredients': 4,
+            'follows': 2,
+            'favorites': 3,
+            'carts': 2,
+            'batch_size': 7,
+            'stdout': StringIO(),
+        }
+        call_command('generate_dataset', **options)
+        generated = User.objects.filter(username__startswith='load')
+        self.assertEqual(generated.count(), 5)
+        self.assertEqual(Recipe.objects.count(), 20)
+        for recipe in Recipe.objects.all():
+            self.assertIn(recipe.recipe_ingredients.count(), range(2, 5))
+            self.assertIn(recipe.tags.count(), range(1, 4))
+        self.assertTrue(Favorite.objects.exists())
+        self.assertTrue(Cart.objects.exists())
+        for counter in counters.COUNTERS:
+            with self.subTest(counter=counter[1]):
+                self.assertEqual(counters.recount(*counter), 0)
+        self.assertEqual(shopping_list.refresh(generated), 0)
+        with self.assertRaises(CommandError):
+            call_command('generate_dataset', **options)
+
+
+class TagFilterTest(RecipeTestCase):
+
+    TAGS = 3
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.all_tags = cls.recipe
+        cls.first_tag, = create_recipes(
+            [cls.author], cls.tags[:1], cls.ingredients, 1, 1
+        )
+        create_recipes([cls.author], cls.tags[2:], cls.ingredients, 1, 1)
+
+    def test_recipe_with_several_tags_once(self):
+        response = APIClient().get(
+            '/api/recipes/?tags=tag0&tags=tag1&limit=10'
+        )
+        self.assertEqual(response.status_code, 200)
+        ids = [recipe['id'] for recipe in response.data['results']]
+        self.assertCountEqual(ids, [self.all_tags.id, self.first_tag.id])
+        self.assertEqual(response.data['count'], 2)
+
+    def test_unknown_tag(self):
+        response = APIClient().get('/api/recipes/?tags=unknown')
+        self.assertEqual(response.status_code, 400)
+
+    def test_benchmark_matches_join(self):
+        call_command(
+            'benchmark_tag_filter', repeat=1, stdout=StringIO()
+        )
+
+
+class QueryPlanTest(RecipeTestCase):
+    """
+    check_query_plans находит в планах свои индексы и падает,
+    если какой-то из них удалить.
+    """
+
+    INGREDIENTS = 5
+    RECIPES = 0
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        authors = [cls.author, create_user(2), create_user(3)]
+        recipes = Recipe.objects.bulk_create(
+            Recipe(
+                name=f'Рецепт {number}',
+                author=authors[number % len(authors)],
+                image='recipe/images/test.png',
+                text='Описание',
+                cooking_time=10,
+            )
+            for number in range(600)
+        )
+        Quantity.objects.bulk_create(
+            Quantity(recipe=recipe, ingredient=ingredient, amount=100)
+            for recipe in recipes for ingredient in cls.ingredients
+        )
+        for model in (Favorite, Cart):
+            model.objects.bulk_create(
+                model(user=cls.author, recipe=recipe)
+                for recipe in recipes[::20]
+            )
+        ShoppingListItem.objects.bulk_create(
+            ShoppingListItem(user=cls.author, ingredient=ingredient, total=1)
+            for ingredient in cls.ingredients
+        )
+        Follow.objects.bulk_create(
+            Follow(user=cls.author, author=author) for author in authors[1:]
+        )
+
+    def setUp(self):
+        super().setUp()
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+                # Даже на сотнях строк планировщик может предпочесть
+                # полный просмотр, поэтому проверяется путь по индексам.
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def test_indexes(self):
+        call_command('check_query_plans', stdout=StringIO())
+
+    def test_missing_index(self):
+        # Модуль sqlite3 кэширует подготовленные EXPLAIN по тексту запроса
+        # и не перестраивает их после DROP INDEX, поэтому каждый вызов
+        # идет со своим --limit и, значит, с другим текстом запросов.
+        for limit, index in enumerate((
+            'recipe_pub_date_idx',
+            'recipe_author_pub_date_idx',
+            'quantity_recipe_ingredient_idx',
+        ), start=7):
+            with self.subTest(index=index), transaction.atomic():
+                with connection.cursor() as cursor:
+                    cursor.execute(f'DROP INDEX {index}')
+                with self.assertRaises(CommandError):
+                    call_command(
+                        'check_query_plans',
+                        limit=limit,
+                        stdout=StringIO()
+                    )
+                transaction.set_rollback(True)
@@ -0,0 +1,46 @@
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from foodgram import constants
+
+
+class UploadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Размер файла превышает допустимый'
+    default_code = 'upload_too_large'
+
+
+class SizeLimitUploadHandler(FileUploadHandler):
+    """
+    Прерывает загрузку, как только файл превысил допустимый размер.
+
+    Стоит первым в цепочке и передает куски файла следующему
+    обработчику, ничего не накапливая. Загрузка останавливается через
+    StopUpload, чтобы парсер закрыл и удалил недописанные временные
+    файлы, а ошибка поднимается уже после этого.
+    """
+
+    too_large = False
+
+    def handle_raw_input(
+        self, input_data, META, content_length, boundary, encoding=None
+    ):
+        if content_length > (
+            constants.MAX_UPLOAD_SIZE + settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+        ):
+            raise UploadTooLarge()
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > constants.MAX_UPLOAD_SIZE:
+            self.too_large = True
+            raise StopUpload(connection_reset=True)
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+    def upload_complete(self):
+        if self.too_large:
+            raise UploadTooLarge()
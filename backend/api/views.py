@@ -1,5 +1,7 @@
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.conf import settings
+from django.db.models import Exists, F, OuterRef, Prefetch, Value, Window
+from django.db.models.functions import RowNumber
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.serializers import SetPasswordSerializer, UserCreateSerializer
@@ -10,19 +12,33 @@ from rest_framework.permissions import SAFE_METHODS, IsAuthenticated
 from rest_framework.response import Response
 
 from foodgram import constants
-from recipes.models import Cart, Favorite, Ingredient, Quantity, Recipe, Tag
+from recipes import batch
+from recipes.models import (Cart, Favorite, Ingredient, Quantity, Recipe,
+                            ShoppingListItem, Tag)
+from recipes.versions import COUNTERS_SCOPE, get_versions
 from users.models import Follow, User
+from .cache import get_response_key, get_search_index
 from .filters import IngredientFilter, RecipeFilter
-from .mixins import CreateListRetrieveMixin
+from .mixins import (CatalogCacheMixin, ConditionalGetMixin,
+                     CreateListRetrieveMixin, ResponseCacheMixin,
+                     StreamedUploadMixin)
+from .negotiation import FallbackContentNegotiation
+from .pagination import RecipePagination, UserPagination
 from .permissions import IsAuthorStaffOrReadOnly
-from .serializers import (CartSerializer, FavoriteSerializer, FollowSerializer,
-                          IngredientSerializer, RecipeReadSerializer,
-                          RecipeWriteSerializer, TagSerializer, UserSerialiser)
+from .renderers import (CsvShoppingListRenderer, PdfShoppingListRenderer,
+                        TextShoppingListRenderer)
+from .serializers import (AuthorReadSerializer, CartSerializer,
+                          FavoriteSerializer, FollowSerializer,
+                          IngredientSerializer, RecipeBatchSerializer,
+                          RecipeImageSerializer, RecipeReadSerializer,
+                          RecipeWriteSerializer, TagSerializer, UserSerialiser,
+                          get_followed_authors)
 
 
 class UserViewSet(CreateListRetrieveMixin):
     queryset = User.objects.all()
     serializer_class = UserSerialiser
+    pagination_class = UserPagination
 
     def get_serializer_class(self):
         if self.action == 'create':
@@ -43,7 +59,7 @@ class UserViewSet(CreateListRetrieveMixin):
         serializer.is_valid(raise_exception=True)
         new_password = serializer.validated_data.get('new_password')
         user.set_password(new_password)
-        user.save()
+        user.save(update_fields=('password',))
         return Response('Пароль успешно изменен', status.HTTP_204_NO_CONTENT)
 
     @action(
@@ -62,16 +78,41 @@ class UserViewSet(CreateListRetrieveMixin):
         permission_classes=(IsAuthenticated,),
     )
     def subscriptions(self, request):
-        user = request.user
-        subscriptions = user.follower.all()
-        pages = self.paginate_queryset(subscriptions)
-        serializer = FollowSerializer(
+        limit = request.query_params.get('recipes_limit')
+        authors = User.objects.filter(
+            followers__user=request.user
+        ).annotate(
+            is_subscribed=Value(True),
+        ).prefetch_related(
+            self.get_recipes_prefetch(limit)
+        )
+        pages = self.paginate_queryset(authors)
+        serializer = AuthorReadSerializer(
             pages,
             many=True,
             context={'request': request}
         )
         return self.get_paginated_response(serializer.data)
 
+    @staticmethod
+    def get_recipes_prefetch(limit):
+        """
+        Prefetch рецептов авторов, ограниченный recipes_limit.
+
+        Ограничение применяется в SQL через нумерацию рецептов
+        внутри каждого автора, а не срезом по каждому автору отдельно.
+        """
+        recipes = Recipe.objects.all()
+        if limit and limit.isdigit():
+            recipes = recipes.annotate(
+                row_number=Window(
+                    expression=RowNumber(),
+                    partition_by=F('author'),
+                    order_by=(F('pub_date').desc(), F('pk').desc()),
+                )
+            ).filter(row_number__lte=int(limit))
+        return Prefetch('recipes', queryset=recipes, to_attr='limited_recipes')
+
     @action(
         detail=True,
         methods=('post',),
@@ -79,9 +120,8 @@ class UserViewSet(CreateListRetrieveMixin):
     )
     def subscribe(self, request, pk=None):
         get_object_or_404(User, pk=pk)
-        data = {'user': request.user.id, 'author': pk}
         serializer = FollowSerializer(
-            data=data,
+            data={'author': pk},
             context={'request': request}
         )
         serializer.is_valid(raise_exception=True)
@@ -109,27 +149,162 @@ class UserViewSet(CreateListRetrieveMixin):
         )
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(
+    ConditionalGetMixin,
+    CatalogCacheMixin,
+    viewsets.ReadOnlyModelViewSet
+):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = None
 
+    def get_etag_parts(self, request):
+        return (self.get_catalog_version(request),)
+
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(
+    ConditionalGetMixin,
+    CatalogCacheMixin,
+    viewsets.ReadOnlyModelViewSet
+):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     pagination_class = None
     filter_backends = (DjangoFilterBackend,)
     filterset_class = IngredientFilter
 
+    def get_etag_parts(self, request):
+        return (self.get_catalog_version(request),)
 
-class RecipeViewSet(viewsets.ModelViewSet):
-    queryset = Recipe.objects.all()
+    def get_list_data(self, request):
+        name = request.query_params.get('name')
+        if not name:
+            return super().get_list_data(request)
+        limit = request.query_params.get('limit')
+        limit = int(limit) if limit and limit.isdigit() else None
+        if settings.INGREDIENT_SEARCH_BACKEND == 'memory':
+            catalog, index = get_search_index(
+                self.queryset,
+                self.serializer_class,
+                self.get_catalog_version(request)
+            )
+            return [catalog[pk] for pk in index.search(name, limit)]
+        queryset = self.filter_queryset(self.get_queryset())[:limit]
+        return self.get_serializer(queryset, many=True).data
+
+
+class RecipeViewSet(
+    ConditionalGetMixin,
+    ResponseCacheMixin,
+    StreamedUploadMixin,
+    viewsets.ModelViewSet
+):
+    queryset = Recipe.objects.select_related('author').prefetch_related(
+        'tags',
+        Prefetch(
+            'recipe_ingredients',
+            queryset=Quantity.objects.select_related('ingredient'),
+        ),
+    )
     http_method_names = constants.ALLOWED_METHODS
+    pagination_class = RecipePagination
     permission_classes = (IsAuthorStaffOrReadOnly,)
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
 
+    def get_queryset(self):
+        user = self.request.user
+        if not user.is_authenticated:
+            return self.queryset.annotate(
+                is_favorited=Value(False),
+                is_in_shopping_cart=Value(False),
+            )
+        return self.queryset.annotate(
+            is_favorited=Exists(
+                Favorite.objects.filter(user=user, recipe=OuterRef('pk'))
+            ),
+            is_in_shopping_cart=Exists(
+                Cart.objects.filter(user=user, recipe=OuterRef('pk'))
+            ),
+        )
+
+    def get_etag_parts(self, request):
+        items = [(Tag, None), (Ingredient, None), (User, None)]
+        if self.action == 'list':
+            items.extend(((Recipe, None), (Recipe, COUNTERS_SCOPE)))
+        pk = self.kwargs.get('pk')
+        if self.action == 'retrieve' and pk.isdigit():
+            items.append((Recipe, pk))
+        user_id = request.user.id
+        if user_id is not None:
+            items.extend(
+                (model, user_id) for model in (Favorite, Cart, Follow)
+            )
+        return [user_id, *get_versions(*items)]
+
+    def get_response_cache_key(self, request):
+        if any(
+            request.query_params.get(name)
+            for name in self.paginator.user_filters
+        ):
+            return None
+        if self.action == 'list':
+            return get_response_key(request, *get_versions(
+                (Recipe, None), (Tag, None), (Ingredient, None), (User, None)
+            ))
+        pk = self.kwargs['pk']
+        if not pk.isdigit():
+            return None
+        return get_response_key(request, *get_versions(
+            (Recipe, pk), (Tag, None), (Ingredient, None)
+        ))
+
+    @staticmethod
+    def get_recipes_data(data):
+        return data['results'] if 'results' in data else [data]
+
+    def refresh_cached(self, data):
+        """
+        Добавление в избранное не меняет версию списка рецептов,
+        поэтому счетчики в списке из кэша берутся из БД.
+        """
+        if self.action != 'list':
+            return data
+        recipes = self.get_recipes_data(data)
+        counts = dict(Recipe.objects.filter(
+            pk__in=[recipe['id'] for recipe in recipes]
+        ).values_list('id', 'favorites_count'))
+        for recipe in recipes:
+            recipe['favorites_count'] = counts.get(
+                recipe['id'], recipe['favorites_count']
+            )
+        return data
+
+    def set_user_flags(self, data, favorites, carts, followed):
+        for recipe in self.get_recipes_data(data):
+            recipe['is_favorited'] = recipe['id'] in favorites
+            recipe['is_in_shopping_cart'] = recipe['id'] in carts
+            recipe['author']['is_subscribed'] = (
+                recipe['author']['id'] in followed
+            )
+        return data
+
+    def anonymize(self, data):
+        return self.set_user_flags(data, set(), set(), set())
+
+    def personalize(self, request, data):
+        ids = [recipe['id'] for recipe in self.get_recipes_data(data)]
+        favorites, carts = (
+            set(model.objects.filter(
+                user=request.user,
+                recipe__in=ids
+            ).values_list('recipe', flat=True))
+            for model in (Favorite, Cart)
+        )
+        return self.set_user_flags(
+            data, favorites, carts, get_followed_authors(request)
+        )
+
     def get_serializer_class(self):
         if self.request.method in SAFE_METHODS:
             return RecipeReadSerializer
@@ -138,8 +313,10 @@ class RecipeViewSet(viewsets.ModelViewSet):
     @staticmethod
     def post_common_logic(request, model_serializer, pk):
         """Функция для общей POST логики избранного и списка покупок."""
-        data = {'user': request.user.id, 'recipe': pk}
-        serializer = model_serializer(data=data)
+        serializer = model_serializer(
+            data={'recipe': pk},
+            context={'request': request}
+        )
         serializer.is_valid(raise_exception=True)
         serializer.save()
         return Response(
@@ -162,6 +339,18 @@ class RecipeViewSet(viewsets.ModelViewSet):
             status.HTTP_204_NO_CONTENT
         )
 
+    @action(detail=True, methods=('patch',))
+    def image(self, request, pk=None):
+        """Замена картинки рецепта файлом из multipart-формы или base64."""
+        serializer = RecipeImageSerializer(
+            self.get_object(),
+            data=request.data,
+            context=self.get_serializer_context()
+        )
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data)
+
     @action(
         detail=True,
         methods=('post',),
@@ -186,27 +375,87 @@ class RecipeViewSet(viewsets.ModelViewSet):
     def shopping_cart_delete(self, request, pk=None):
         return self.delete_common_logic(request.user, Cart, pk)
 
+    @staticmethod
+    def batch_common_logic(request, model):
+        """
+        Общая логика пакетного добавления и удаления рецептов
+        избранного и списка покупок с результатом по каждому рецепту.
+        """
+        serializer = RecipeBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = serializer.validated_data['recipes']
+        found = set(Recipe.objects.filter(
+            pk__in=recipe_ids
+        ).values_list('id', flat=True))
+        if request.method == 'POST':
+            done = batch.add_recipes(
+                model,
+                request.user.id,
+                [pk for pk in recipe_ids if pk in found]
+            )
+            result, error = 'added', 'Вы уже добавляли этот рецепт'
+        else:
+            done = batch.remove_recipes(model, request.user.id, found)
+            result, error = 'removed', 'Вы не добавляли этот рецепт'
+        results = []
+        for pk in recipe_ids:
+            if pk not in found:
+                results.append({'id': pk, 'errors': 'Рецепт не найден'})
+            elif pk in done:
+                results.append({'id': pk, 'result': result})
+            else:
+                results.append({'id': pk, 'errors': error})
+        return Response(results)
+
+    @action(
+        detail=False,
+        methods=('post', 'delete'),
+        url_path='favorite/batch',
+        permission_classes=(IsAuthenticated,),
+    )
+    def favorite_batch(self, request):
+        return self.batch_common_logic(request, Favorite)
+
+    @action(
+        detail=False,
+        methods=('post', 'delete'),
+        url_path='shopping_cart/batch',
+        permission_classes=(IsAuthenticated,),
+    )
+    def shopping_cart_batch(self, request):
+        return self.batch_common_logic(request, Cart)
+
     @action(
         detail=False,
         methods=('get',),
         permission_classes=(IsAuthenticated,),
+        renderer_classes=(
+            TextShoppingListRenderer,
+            CsvShoppingListRenderer,
+            PdfShoppingListRenderer,
+        ),
+        content_negotiation_class=FallbackContentNegotiation,
     )
     def download_shopping_cart(self, request):
-        user = request.user
-        ingredients = Quantity.objects.filter(recipe__carts__user=user)
-        annotated_ingredients = ingredients.values(
+        """
+        Список покупок в формате txt, csv или pdf.
+
+        Формат выбирается параметром format или заголовком Accept,
+        при неподходящем Accept отдается txt.
+        """
+        ingredients = ShoppingListItem.objects.filter(
+            user=request.user
+        ).values_list(
             'ingredient__name',
-            'ingredient__measurement_unit'
-        ).annotate(total=Sum('amount'))
-        shopping_list = ''
-        for ingredient in annotated_ingredients:
-            name = ingredient['ingredient__name']
-            unit = ingredient['ingredient__measurement_unit']
-            total = ingredient['total']
-            shopping_list += f'{name}\t{total} {unit}\n'
-        response = HttpResponse(
-            shopping_list,
-            content_type='text/plain; charset=UTF-8'
+            'ingredient__measurement_unit',
+            'total'
+        ).order_by('ingredient__name').iterator()
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(
+            renderer.stream(ingredients),
+            content_type=renderer.get_content_type()
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename={renderer.get_filename()}'
         )
-        response['Content-Disposition'] = ('attachment; filename=list.txt')
         return response
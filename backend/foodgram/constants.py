@@ -10,3 +10,14 @@ MAX_COOKING_TIME = 600
 MIN_INGREDIENT_AMOUNT = 1
 MAX_INGREDIENT_AMOUNT = 3000
 ALLOWED_METHODS = ('get', 'post', 'patch', 'delete')
+PDF_MARGIN = 50
+PDF_TITLE_SIZE = 16
+PDF_FONT_SIZE = 12
+PDF_LINE_HEIGHT = 18
+PDF_SPOOL_SIZE = 1024 * 1024
+PDF_CHUNK_SIZE = 64 * 1024
+IMAGE_MAX_SIZE = (1280, 1280)
+THUMBNAIL_SIZE = (400, 400)
+WEBP_QUALITY = 80
+MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+MAX_BATCH_SIZE = 100
@@ -77,6 +77,54 @@ DATABASES = {
     }
 }
 
+# Кэш default должен быть общим для всех процессов: в нем хранятся версии
+# данных, и команды вроде import_data, запущенные отдельным процессом,
+# сбрасывают через них кэши сервера. Таблицу DatabaseCache создает
+# миграция recipes. С ней каждое чтение версии - запрос к БД, поэтому
+# в продакшене лучше указать через CACHE_BACKEND Redis или Memcached.
+# В local хранятся ответы и количества записей: их ключи содержат версии,
+# поэтому кэш в памяти процесса не отдает устаревших данных.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.db.DatabaseCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'django_cache'),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 10000)),
+        },
+    },
+    'local': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('LOCAL_CACHE_MAX_ENTRIES', 1000)),
+        },
+    },
+}
+
+# Версии тегов и ингредиентов хранятся и в памяти процесса и сверяются
+# с общим кэшем не чаще раза в VERSION_LOCAL_TIMEOUT секунд, поэтому
+# справочники отдаются без обращения к кэшу и БД. Цена - изменения
+# из других процессов (админка, import_data) видны с этой задержкой.
+VERSION_LOCAL_TIMEOUT = int(os.getenv('VERSION_LOCAL_TIMEOUT', 5))
+
+# Поиск ингредиентов по названию: memory - индекс в памяти процесса,
+# orm - запрос к БД, trigram - GIN-индекс pg_trgm (только PostgreSQL).
+INGREDIENT_SEARCH_BACKEND = os.getenv('INGREDIENT_SEARCH_BACKEND', 'memory')
+
+# Число потоков для создания копий картинок рецептов вне запроса
+# и длина очереди, при переполнении которой картинка обрабатывается
+# прямо в запросе. При IMAGE_WORKERS = 0 обработка синхронная.
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 2))
+
+IMAGE_QUEUE_SIZE = int(os.getenv('IMAGE_QUEUE_SIZE', 32))
+
+SHOPPING_LIST_FONT = os.getenv(
+    'SHOPPING_LIST_FONT',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -121,3 +169,19 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'api.pagination.CustomPagination',
     'PAGE_SIZE': 6
 }
+
+# Время хранения в кэше количества записей для пагинации и ответов
+# со списком рецептов в секундах и порог, начиная с которого
+# в PostgreSQL используется оценка количества записей планировщиком.
+COUNT_CACHE_TIMEOUT = int(os.getenv('COUNT_CACHE_TIMEOUT', 300))
+
+RESPONSE_CACHE_TIMEOUT = int(os.getenv('RESPONSE_CACHE_TIMEOUT', 600))
+
+COUNT_ESTIMATE_THRESHOLD = (
+    int(os.getenv('COUNT_ESTIMATE_THRESHOLD'))
+    if os.getenv('COUNT_ESTIMATE_THRESHOLD') else None
+)
+
+# Через сколько запросов процесс переносит накопленную статистику
+# попаданий в кэш ответов в общий кэш.
+RESPONSE_STATS_FLUSH = int(os.getenv('RESPONSE_STATS_FLUSH', 100))
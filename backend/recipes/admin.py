@@ -1,5 +1,7 @@
 from django.contrib import admin
 
+from . import shopping_list
+from .images import schedule_derivatives
 from .models import Cart, Favorite, Ingredient, Quantity, Recipe, Tag
 
 
@@ -35,17 +37,31 @@ class RecipeAdmin(admin.ModelAdmin):
     list_filter = ('tags',)
 
     def change_view(self, request, object_id, extra_context=None):
-        self.readonly_fields = ['favorites_count']
+        self.readonly_fields = ['favorites_count', 'image_webp', 'thumbnail']
         return super().change_view(request, object_id)
 
     def add_view(self, request, extra_context=None):
-        self.readonly_fields = []
+        self.readonly_fields = ['image_webp', 'thumbnail']
         return super().add_view(request)
 
-    def favorites_count(self, obj):
-        return obj.favorites.count()
-
-    favorites_count.short_description = 'Количество добавлений в избранное'
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if 'image' in form.changed_data:
+            schedule_derivatives(obj)
+
+    def save_related(self, request, form, formsets, change):
+        ingredient_ids = set(
+            form.instance.recipe_ingredients.values_list(
+                'ingredient', flat=True
+            )
+        )
+        super().save_related(request, form, formsets, change)
+        ingredient_ids |= set(
+            form.instance.recipe_ingredients.values_list(
+                'ingredient', flat=True
+            )
+        )
+        shopping_list.refresh_recipe(form.instance.id, ingredient_ids)
 
 
 @admin.register(Favorite)
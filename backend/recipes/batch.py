@@ -0,0 +1,87 @@
+from django.db import connection, transaction
+
+from . import counters, shopping_list
+from .models import Cart, Favorite, Quantity
+from .versions import bump_version
+
+
+def refresh_dependent(model, user_id, recipe_ids):
+    """
+    Обновляет то, что сигналы обновили бы для каждой записи:
+    список покупок, счетчики избранного и версии данных.
+    """
+    if not recipe_ids:
+        return
+    if model is Cart:
+        shopping_list.refresh(
+            [user_id],
+            set(Quantity.objects.filter(
+                recipe__in=recipe_ids
+            ).values_list('ingredient', flat=True))
+        )
+    if model is Favorite:
+        # Счетчики после INSERT или DELETE без сигналов расходятся
+        # с фактическими, и пересчет сам меняет версии этих рецептов.
+        counters.recount_favorites(recipe_ids)
+    bump_version(model, user_id)
+
+
+def execute_returning(sql, params):
+    """Выполняет запрос с RETURNING и возвращает множество значений."""
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return {row[0] for row in cursor.fetchall()}
+
+
+def get_columns(model):
+    """Таблица модели и ее столбцы user и recipe для сырого SQL."""
+    quote = connection.ops.quote_name
+    return (
+        quote(model._meta.db_table),
+        quote(model._meta.get_field('user').column),
+        quote(model._meta.get_field('recipe').column),
+    )
+
+
+@transaction.atomic
+def add_recipes(model, user_id, recipe_ids):
+    """
+    Добавляет рецепты в избранное или корзину одним INSERT.
+
+    Рецепты, которые уже есть у пользователя, в том числе добавленные
+    одновременным запросом, пропускаются через ON CONFLICT DO NOTHING.
+    Сигналы при этом не отправляются, поэтому список покупок,
+    счетчики и версии данных обновляются здесь же.
+    Возвращает id рецептов, которые действительно были добавлены.
+    """
+    if not recipe_ids:
+        return set()
+    table, user, recipe = get_columns(model)
+    rows = ', '.join(['(%s, %s)'] * len(recipe_ids))
+    added = execute_returning(
+        f'INSERT INTO {table} ({user}, {recipe}) VALUES {rows} '
+        f'ON CONFLICT DO NOTHING RETURNING {recipe}',
+        [value for pk in recipe_ids for value in (user_id, pk)]
+    )
+    refresh_dependent(model, user_id, added)
+    return added
+
+
+@transaction.atomic
+def remove_recipes(model, user_id, recipe_ids):
+    """
+    Удаляет рецепты из избранного или корзины одним DELETE.
+
+    Возвращает id рецептов, которые были у пользователя.
+    """
+    if not recipe_ids:
+        return set()
+    table, user, recipe = get_columns(model)
+    placeholders = ', '.join(['%s'] * len(recipe_ids))
+    removed = execute_returning(
+        f'DELETE FROM {table} WHERE {user} = %s '
+        f'AND {recipe} IN ({placeholders}) RETURNING {recipe}',
+        [user_id, *recipe_ids]
+    )
+    refresh_dependent(model, user_id, removed)
+    return removed
@@ -0,0 +1,64 @@
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from users.models import Follow, User
+from .models import Favorite, Recipe
+from .versions import COUNTERS_SCOPE, bump_versions
+
+# Денормализованные счетчики: модель, поле, модель связи и поле в ней,
+# ссылающееся на запись со счетчиком.
+COUNTERS = (
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Follow, 'author'),
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+)
+
+
+def change(model, pk, field, delta):
+    """Атомарно меняет счетчик одной записи на delta."""
+    queryset = model.objects.filter(pk=pk)
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    queryset.update(**{field: F(field) + delta})
+
+
+def get_actual_count(related_model, related_field):
+    """Подзапрос фактического количества связанных записей."""
+    return Coalesce(
+        Subquery(
+            related_model.objects.filter(
+                **{related_field: OuterRef('pk')}
+            ).order_by().values(related_field).annotate(
+                total=Count('pk')
+            ).values('total')
+        ),
+        Value(0)
+    )
+
+
+def recount(model, field, related_model, related_field, pks=None):
+    """
+    Пересчитывает счетчик по связанным записям.
+
+    Меняются версии исправленных записей и версия счетчиков модели,
+    чтобы кэшированные ответы не показывали прежние значения.
+    Возвращает количество записей, в которых счетчик расходился
+    с фактическим значением.
+    """
+    queryset = model.objects.all()
+    if pks is not None:
+        queryset = queryset.filter(pk__in=pks)
+    actual = get_actual_count(related_model, related_field)
+    drifted = list(
+        queryset.annotate(actual=actual).exclude(
+            **{field: F('actual')}
+        ).values_list('pk', flat=True)
+    )
+    model.objects.filter(pk__in=drifted).update(**{field: actual})
+    if drifted:
+        bump_versions(model, [COUNTERS_SCOPE, *drifted])
+    return len(drifted)
+
+
+def recount_favorites(recipe_ids):
+    return recount(Recipe, 'favorites_count', Favorite, 'recipe', recipe_ids)
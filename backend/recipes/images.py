@@ -0,0 +1,129 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+from threading import BoundedSemaphore, Lock
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import DatabaseError, connection, transaction
+from PIL import Image, ImageOps
+
+from foodgram import constants
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVES = {
+    'image_webp': constants.IMAGE_MAX_SIZE,
+    'thumbnail': constants.THUMBNAIL_SIZE,
+}
+
+
+def encode_webp(image, size):
+    """Уменьшает картинку до размеров size и кодирует ее в WebP."""
+    image = image.copy()
+    image.thumbnail(size, Image.LANCZOS)
+    buffer = BytesIO()
+    image.save(buffer, 'WEBP', quality=constants.WEBP_QUALITY)
+    return buffer.getvalue()
+
+
+def create_derivatives(recipe):
+    """
+    Создает уменьшенные копии картинки рецепта в формате WebP.
+
+    Прежние копии удаляются из хранилища. Поворот из EXIF применяется
+    к пикселям, а сами метаданные в копии не попадают. Прозрачность
+    сохраняется, в том числе у картинок с палитрой.
+    """
+    with recipe.image.open('rb') as file:
+        image = ImageOps.exif_transpose(Image.open(file))
+        if image.mode not in ('RGB', 'RGBA'):
+            transparent = (
+                'A' in image.getbands() or 'transparency' in image.info
+            )
+            image = image.convert('RGBA' if transparent else 'RGB')
+    name = f'{Path(recipe.image.name).stem}.webp'
+    for field_name, size in DERIVATIVES.items():
+        field = getattr(recipe, field_name)
+        if field:
+            field.delete(save=False)
+        field.save(name, ContentFile(encode_webp(image, size)), save=False)
+    recipe.save(update_fields=tuple(DERIVATIVES))
+
+
+_executor = None
+_executor_lock = Lock()
+_slots = BoundedSemaphore(
+    settings.IMAGE_WORKERS + settings.IMAGE_QUEUE_SIZE
+)
+
+
+def get_executor():
+    """Лениво создает пул потоков для обработки картинок."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.IMAGE_WORKERS,
+                thread_name_prefix='recipe-images'
+            )
+    return _executor
+
+
+def process(recipe):
+    """Создает копии картинки рецепта, записывая ошибки в лог."""
+    try:
+        create_derivatives(recipe)
+    except (
+        DatabaseError, OSError, ValueError, Image.DecompressionBombError
+    ):
+        logger.exception(
+            'Не удалось обработать картинку рецепта %s', recipe.pk
+        )
+
+
+def process_recipe(recipe_id):
+    """Создает копии картинки рецепта по его id."""
+    from .models import Recipe
+
+    try:
+        recipe = Recipe.objects.filter(pk=recipe_id).first()
+    except DatabaseError:
+        logger.exception('Не удалось загрузить рецепт %s', recipe_id)
+        return
+    if recipe is not None and recipe.image:
+        process(recipe)
+
+
+def run_in_worker(recipe_id):
+    try:
+        process_recipe(recipe_id)
+    finally:
+        _slots.release()
+        connection.close()
+
+
+def submit(recipe_id):
+    """
+    Отправляет рецепт в пул, а при переполненной очереди
+    обрабатывает его в текущем потоке.
+    """
+    if _slots.acquire(blocking=False):
+        get_executor().submit(run_in_worker, recipe_id)
+    else:
+        process_recipe(recipe_id)
+
+
+def schedule_derivatives(recipe):
+    """
+    Ставит создание копий картинки в очередь после фиксации транзакции.
+
+    При IMAGE_WORKERS = 0 копии создаются в текущем потоке, тоже после
+    фиксации, и сразу попадают в переданный объект рецепта.
+    """
+    if not settings.IMAGE_WORKERS:
+        transaction.on_commit(lambda: process(recipe))
+        return
+    recipe_id = recipe.pk
+    transaction.on_commit(lambda: submit(recipe_id))
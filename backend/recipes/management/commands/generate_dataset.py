@@ -0,0 +1,269 @@
+import random
+import time
+from datetime import timedelta
+from io import BytesIO
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from PIL import Image
+
+from recipes import counters, shopping_list
+from recipes.models import (Cart, Favorite, Ingredient, Quantity, Recipe,
+                            Tag)
+from recipes.versions import ROWS_SCOPE, bump_versions
+from users.models import Follow, User
+
+PLACEHOLDER_IMAGE = 'recipe/images/generated.png'
+
+
+def get_cum_weights(size, exponent):
+    """
+    Накопленные веса закона Ципфа: элемент с рангом k выбирается
+    с вероятностью, пропорциональной 1 / k ** exponent.
+    """
+    total = 0
+    cum_weights = []
+    for rank in range(1, size + 1):
+        total += 1 / rank ** exponent
+        cum_weights.append(total)
+    return cum_weights
+
+
+class PowerLaw:
+    """Выбор элементов с популярностью по степенному закону."""
+
+    def __init__(self, rng, population, exponent):
+        self.rng = rng
+        self.population = list(population)
+        rng.shuffle(self.population)
+        self.cum_weights = get_cum_weights(len(self.population), exponent)
+
+    def pick(self, count, exclude=None):
+        """До count различных элементов, кроме exclude."""
+        count = min(count, len(self.population) - (exclude is not None))
+        chosen = set()
+        for _ in range(10):
+            if len(chosen) >= count:
+                break
+            chosen.update(self.rng.choices(
+                self.population,
+                cum_weights=self.cum_weights,
+                k=count - len(chosen)
+            ))
+            chosen.discard(exclude)
+        return list(islice(chosen, count))
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class Command(BaseCommand):
+    help = (
+        'Генерация синтетических пользователей, рецептов, подписок, '
+        'избранного и корзин для нагрузочного тестирования'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument('--min-ingredients', type=int, default=3)
+        parser.add_argument('--max-ingredients', type=int, default=12)
+        parser.add_argument('--max-tags', type=int, default=3)
+        parser.add_argument(
+            '--follows',
+            type=int,
+            default=10,
+            help='Среднее число подписок пользователя'
+        )
+        parser.add_argument(
+            '--favorites',
+            type=int,
+            default=20,
+            help='Среднее число рецептов в избранном пользователя'
+        )
+        parser.add_argument(
+            '--carts',
+            type=int,
+            default=5,
+            help='Среднее число рецептов в корзине пользователя'
+        )
+        parser.add_argument(
+            '--exponent',
+            type=float,
+            default=1.1,
+            help='Показатель степенного закона популярности'
+        )
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument(
+            '--prefix',
+            default='load',
+            help='Префикс имен и почт создаваемых пользователей'
+        )
+        parser.add_argument('--password', default='load-test-password')
+
+    def get_image(self):
+        """Одна картинка-заглушка для всех созданных рецептов."""
+        if not default_storage.exists(PLACEHOLDER_IMAGE):
+            buffer = BytesIO()
+            Image.new('RGB', (400, 400), '#e26c2d').save(buffer, 'PNG')
+            default_storage.save(
+                PLACEHOLDER_IMAGE, ContentFile(buffer.getvalue())
+            )
+        return PLACEHOLDER_IMAGE
+
+    def create_users(self, options):
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=prefix).exists():
+            raise CommandError(
+                f'Пользователи с префиксом {prefix} уже есть, '
+                'укажите другой --prefix'
+            )
+        password = make_password(options['password'])
+        users = (
+            User(
+                username=f'{prefix}{number}',
+                email=f'{prefix}{number}@example.com',
+                first_name='Имя',
+                last_name=f'Фамилия {number}',
+                password=password,
+            )
+            for number in range(options['users'])
+        )
+        user_ids = []
+        for batch in batched(users, options['batch_size']):
+            user_ids.extend(
+                user.id for user in User.objects.bulk_create(batch)
+            )
+        return user_ids
+
+    def create_recipes(self, rng, authors, options):
+        image = self.get_image()
+        now = timezone.now()
+        recipe_ids = []
+        for batch in batched(range(options['recipes']), options['batch_size']):
+            recipes = Recipe.objects.bulk_create(
+                Recipe(
+                    name=f'Рецепт {number}',
+                    author_id=authors.pick(1)[0],
+                    image=image,
+                    text='Описание сгенерированного рецепта',
+                    cooking_time=rng.randint(1, 180),
+                )
+                for number in batch
+            )
+            # auto_now_add перезаписывает дату при вставке, поэтому
+            # разнесенные во времени даты публикации задаются отдельно.
+            for recipe in recipes:
+                recipe.pub_date = now - timedelta(
+                    minutes=options['recipes'] - len(recipe_ids)
+                )
+                recipe_ids.append(recipe.id)
+            Recipe.objects.bulk_update(recipes, ('pub_date',))
+        return recipe_ids
+
+    def create_recipe_relations(self, rng, recipe_ids, options):
+        ingredients = PowerLaw(
+            rng,
+            Ingredient.objects.order_by('id').values_list('id', flat=True),
+            options['exponent']
+        )
+        tag_ids = list(Tag.objects.order_by('id').values_list('id', flat=True))
+        max_tags = min(options['max_tags'], len(tag_ids))
+        RecipeTag = Recipe.tags.through
+        for batch in batched(recipe_ids, options['batch_size']):
+            quantities = []
+            recipe_tags = []
+            for recipe_id in batch:
+                count = rng.randint(
+                    options['min_ingredients'], options['max_ingredients']
+                )
+                quantities.extend(
+                    Quantity(
+                        recipe_id=recipe_id,
+                        ingredient_id=ingredient_id,
+                        amount=rng.randint(1, 500)
+                    )
+                    for ingredient_id in ingredients.pick(count)
+                )
+                recipe_tags.extend(
+                    RecipeTag(recipe_id=recipe_id, tag_id=tag_id)
+                    for tag_id in rng.sample(tag_ids, rng.randint(1, max_tags))
+                )
+            Quantity.objects.bulk_create(quantities)
+            RecipeTag.objects.bulk_create(recipe_tags)
+
+    def create_user_relations(self, rng, model, field, user_ids, popular,
+                              average, batch_size):
+        """
+        Создает для каждого пользователя в среднем average связей
+        с популярными по степенному закону объектами.
+        """
+        created = 0
+        for batch in batched(user_ids, batch_size):
+            objects = [
+                model(user_id=user_id, **{f'{field}_id': pk})
+                for user_id in batch
+                for pk in popular.pick(
+                    rng.randint(0, 2 * average),
+                    exclude=user_id if model is Follow else None
+                )
+            ]
+            model.objects.bulk_create(objects, ignore_conflicts=True)
+            created += len(objects)
+        return created
+
+    def handle(self, *args, **options):
+        if not connection.features.can_return_rows_from_bulk_insert:
+            raise CommandError(
+                f'{connection.vendor}: bulk_create не возвращает id записей'
+            )
+        if not Ingredient.objects.exists() or not Tag.objects.exists():
+            raise CommandError(
+                'Сначала загрузите ингредиенты и теги командой import_data'
+            )
+        if options['min_ingredients'] > options['max_ingredients']:
+            raise CommandError(
+                '--min-ingredients не может быть больше --max-ingredients'
+            )
+        start = time.perf_counter()
+        rng = random.Random(options['seed'])
+        batch_size = options['batch_size']
+        user_ids = self.create_users(options)
+        self.stdout.write(f'Пользователей: {len(user_ids)}')
+        authors = PowerLaw(rng, user_ids, options['exponent'])
+        recipe_ids = self.create_recipes(rng, authors, options)
+        self.create_recipe_relations(rng, recipe_ids, options)
+        self.stdout.write(f'Рецептов: {len(recipe_ids)}')
+        recipes = PowerLaw(rng, recipe_ids, options['exponent'])
+        for model, field, popular, average in (
+            (Follow, 'author', authors, options['follows']),
+            (Favorite, 'recipe', recipes, options['favorites']),
+            (Cart, 'recipe', recipes, options['carts']),
+        ):
+            created = self.create_user_relations(
+                rng, model, field, user_ids, popular, average, batch_size
+            )
+            self.stdout.write(
+                f'{model._meta.verbose_name_plural}: {created}'
+            )
+        # bulk_create не отправляет сигналы, поэтому счетчики,
+        # списки покупок и версии данных обновляются отдельно.
+        for counter in counters.COUNTERS:
+            counters.recount(*counter)
+        for batch in batched(user_ids, batch_size):
+            shopping_list.refresh(batch)
+        for model in (User, Recipe):
+            bump_versions(model, (None, ROWS_SCOPE))
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Данные сгенерированы за {elapsed:.1f} с'
+        ))
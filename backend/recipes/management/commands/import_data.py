@@ -1,27 +1,317 @@
+import csv
 import json
+import time
+from itertools import islice
+from pathlib import Path
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
 
 from recipes.models import Ingredient, Tag
+from recipes.versions import bump_version
+
+DATA_DIR = Path(__file__).resolve().parents[2] / 'data'
+
+MODELS = {
+    'ingredients': Ingredient,
+    'tags': Tag,
+}
+
+# Загружаемые поля и поля, по которым запись считается уже существующей.
+FIELDS = {
+    Ingredient: ('name', 'measurement_unit'),
+    Tag: ('name', 'color', 'slug'),
+}
+UNIQUE_FIELDS = {
+    Ingredient: ('name', 'measurement_unit'),
+    Tag: ('slug',),
+}
+
+DEFAULT_FILES = (
+    ('ingredients', 'ingredients.json'),
+    ('tags', 'tags.json'),
+)
+
+FORMATS = {
+    '.json': 'json',
+    '.ndjson': 'ndjson',
+    '.jsonl': 'ndjson',
+    '.csv': 'csv',
+}
+
+JSON_CHUNK_SIZE = 64 * 1024
+JSON_SEPARATORS = ' \t\r\n,[]'
+
+
+def read_json(file, fields):
+    """
+    Читает JSON-массив объектов по частям, не загружая файл целиком.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    for chunk in iter(lambda: file.read(JSON_CHUNK_SIZE), ''):
+        buffer += chunk
+        position = 0
+        while True:
+            while (
+                position < len(buffer)
+                and buffer[position] in JSON_SEPARATORS
+            ):
+                position += 1
+            try:
+                obj, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                break
+            yield obj
+        buffer = buffer[position:]
+    if buffer.strip(JSON_SEPARATORS):
+        raise CommandError(f'Некорректный JSON: {buffer[:50]!r}')
+
+
+def read_ndjson(file, fields):
+    for line in file:
+        if line.strip():
+            yield json.loads(line)
+
+
+def read_csv(file, fields):
+    """
+    Читает CSV. Первая строка считается заголовком, если в ней есть
+    все загружаемые поля, иначе колонки идут в порядке fields.
+    """
+    reader = csv.reader(file)
+    header = next(reader, None)
+    if header is None:
+        return
+    if not set(fields) <= set(header):
+        yield dict(zip(fields, header))
+        header = fields
+    for row in reader:
+        if row:
+            yield dict(zip(header, row))
+
+
+READERS = {
+    'json': read_json,
+    'ndjson': read_ndjson,
+    'csv': read_csv,
+}
 
 
 class Command(BaseCommand):
-    help = 'Импорт данных из json файла в базу данных'
+    help = (
+        'Потоковый импорт ингредиентов и тегов из файлов JSON, NDJSON '
+        'и CSV. Без аргументов загружает ingredients.json и tags.json '
+        'из recipes/data'
+    )
 
-    def import_data(self, model, file_path):
-        """Функция загрузки json-файла и сохрания в базу данных."""
-        with open(f'recipes/data/{file_path}', encoding='utf-8') as json_file:
-            data = json.load(json_file)
-            objects = [model(**object_data) for object_data in data]
-            model.objects.bulk_create(objects)
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='*')
+        parser.add_argument(
+            '--model',
+            choices=MODELS,
+            default='ingredients',
+            help='Модель для файлов, переданных аргументами'
+        )
+        parser.add_argument(
+            '--format',
+            choices=READERS,
+            help='Формат файлов, по умолчанию определяется по расширению'
+        )
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument(
+            '--mode',
+            choices=('skip', 'upsert'),
+            default='skip',
+            help=(
+                'skip - пропускать существующие записи, '
+                'upsert - обновлять их'
+            )
+        )
+        parser.add_argument(
+            '--copy',
+            action='store_true',
+            help='Загрузка через COPY (только PostgreSQL)'
+        )
 
-    def handle(self, *args, **options):
-        MODEL_PATH = {
-            Ingredient: 'ingredients.json',
-            Tag: 'tags.json',
-        }
+    def get_rows(self, model, path, file_format):
+        """Значения загружаемых полей для каждой записи файла."""
+        fields = FIELDS[model]
+        with open(path, encoding='utf-8-sig', newline='') as file:
+            records = READERS[file_format](file, fields)
+            for number, record in enumerate(records, 1):
+                try:
+                    yield tuple(record[field] for field in fields)
+                except (KeyError, TypeError):
+                    raise CommandError(
+                        f'{path}, запись {number}: ожидаются поля '
+                        f'{", ".join(fields)}'
+                    )
+
+    @staticmethod
+    def deduplicate(model, rows):
+        """Убирает из пачки повторы по уникальным полям."""
+        fields = FIELDS[model]
+        positions = [fields.index(field) for field in UNIQUE_FIELDS[model]]
+        return list({
+            tuple(values[position] for position in positions): values
+            for values in rows
+        }.values())
+
+    @staticmethod
+    def get_update_fields(model):
+        return [
+            field for field in FIELDS[model]
+            if field not in UNIQUE_FIELDS[model]
+        ]
+
+    @staticmethod
+    def exclude_conflicts(model, rows):
+        """
+        Убирает записи, которые по другим уникальным полям совпадают
+        с записью с другим ключом: ON CONFLICT по UNIQUE_FIELDS
+        обновляет только запись с тем же ключом, а на таких падает.
+        """
+        fields = FIELDS[model]
+        positions = [fields.index(field) for field in UNIQUE_FIELDS[model]]
+
+        def get_key(values):
+            return tuple(values[position] for position in positions)
+
+        for field in FIELDS[model]:
+            if (
+                field in UNIQUE_FIELDS[model]
+                or not model._meta.get_field(field).unique
+            ):
+                continue
+            position = fields.index(field)
+            owners = {
+                value: tuple(key)
+                for value, *key in model.objects.filter(**{
+                    f'{field}__in': [values[position] for values in rows]
+                }).values_list(field, *UNIQUE_FIELDS[model])
+            }
+            rows = [
+                values for values in rows
+                if owners.setdefault(values[position], get_key(values))
+                == get_key(values)
+            ]
+        return rows
 
-        for model, file_path in MODEL_PATH.items():
-            self.import_data(model, file_path)
+    def save_batch(self, model, rows, mode):
+        fields = FIELDS[model]
+        objects = [model(**dict(zip(fields, values))) for values in rows]
+        update_fields = self.get_update_fields(model)
+        if mode == 'upsert' and update_fields:
+            model.objects.bulk_create(
+                objects,
+                update_conflicts=True,
+                unique_fields=UNIQUE_FIELDS[model],
+                update_fields=update_fields
+            )
+        else:
+            model.objects.bulk_create(objects, ignore_conflicts=True)
+
+    def copy_batch(self, model, rows, mode):
+        """
+        Загружает пачку через COPY во временную таблицу
+        и переносит ее в основную одним INSERT ... ON CONFLICT.
+        """
+        quote = connection.ops.quote_name
+
+        def get_columns(fields):
+            return [
+                quote(model._meta.get_field(name).column) for name in fields
+            ]
+
+        table = quote(model._meta.db_table)
+        columns = ', '.join(get_columns(FIELDS[model]))
+        update_columns = get_columns(self.get_update_fields(model))
+        if mode == 'upsert' and update_columns:
+            conflict = '({}) DO UPDATE SET {}'.format(
+                ', '.join(get_columns(UNIQUE_FIELDS[model])),
+                ', '.join(
+                    f'{column} = EXCLUDED.{column}'
+                    for column in update_columns
+                )
+            )
+        else:
+            conflict = 'DO NOTHING'
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMP TABLE import_batch AS '
+                f'SELECT {columns} FROM {table} WITH NO DATA'
+            )
+            with cursor.copy(
+                f'COPY import_batch ({columns}) FROM STDIN'
+            ) as copy:
+                for values in rows:
+                    copy.write_row(values)
+            cursor.execute(
+                f'INSERT INTO {table} ({columns}) '
+                f'SELECT {columns} FROM import_batch ON CONFLICT {conflict}'
+            )
+            cursor.execute('DROP TABLE import_batch')
+
+    def import_file(self, model, path, file_format, options):
+        """Загружает файл пачками и возвращает число прочитанных записей."""
+        save = self.copy_batch if options['copy'] else self.save_batch
+        rows = self.get_rows(model, path, file_format)
+        read = 0
+        while True:
+            batch = list(islice(rows, options['batch_size']))
+            if not batch:
+                return read
+            read += len(batch)
+            batch = self.deduplicate(model, batch)
+            if options['mode'] == 'upsert':
+                count = len(batch)
+                batch = self.exclude_conflicts(model, batch)
+                if len(batch) < count:
+                    self.stderr.write(
+                        f'{path.name}: пропущено записей, совпадающих '
+                        f'с другими по уникальным полям: {count - len(batch)}'
+                    )
+            save(model, batch, options['mode'])
+            if options['verbosity'] > 1:
+                self.stdout.write(f'{path.name}: обработано записей {read}')
+
+    def handle(self, *args, **options):
+        if options['copy'] and connection.vendor != 'postgresql':
+            raise CommandError('COPY доступен только для PostgreSQL')
+        if options['batch_size'] < 1:
+            raise CommandError('Размер пачки должен быть больше нуля')
+        if options['files']:
+            files = [
+                (MODELS[options['model']], Path(path))
+                for path in options['files']
+            ]
+        else:
+            files = [
+                (MODELS[name], DATA_DIR / file_name)
+                for name, file_name in DEFAULT_FILES
+            ]
+        for model, path in files:
+            if options['mode'] == 'upsert' and not self.get_update_fields(
+                model
+            ):
+                self.stderr.write(
+                    f'{path.name}: все загружаемые поля входят в ключ, '
+                    'существующие записи пропускаются'
+                )
+            file_format = options['format'] or FORMATS.get(path.suffix)
+            if file_format is None:
+                raise CommandError(f'{path}: неизвестный формат файла')
+            if not path.exists():
+                raise CommandError(f'{path}: файл не найден')
+            count = model.objects.count()
+            start = time.perf_counter()
+            read = self.import_file(model, path, file_format, options)
+            elapsed = time.perf_counter() - start
+            added = model.objects.count() - count
+            bump_version(model)
             self.stdout.write(self.style.SUCCESS(
-                f'Данные из {file_path} успешно загружены'))
+                f'Данные из {path.name} успешно загружены: '
+                f'прочитано {read}, добавлено {added}, '
+                f'{elapsed:.2f} с, {read / max(elapsed, 1e-6):.0f} записей/с'
+            ))
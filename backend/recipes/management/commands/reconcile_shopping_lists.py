@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from recipes import shopping_list
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = 'Сверка сохраненных списков покупок с корзинами пользователей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        user_ids = User.objects.filter(
+            Q(carts__isnull=False) | Q(shopping_list__isnull=False)
+        ).values_list('id', flat=True).distinct().order_by('id')
+        batch_size = options['batch_size']
+        batch = []
+        drift = 0
+        for user_id in user_ids.iterator():
+            batch.append(user_id)
+            if len(batch) == batch_size:
+                drift += shopping_list.refresh(batch)
+                batch = []
+        if batch:
+            drift += shopping_list.refresh(batch)
+        self.stdout.write(self.style.SUCCESS(
+            f'Списки покупок сверены, исправлено строк: {drift}'
+        ))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from recipes import counters
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчет счетчиков рецептов, подписчиков и добавлений в избранное '
+        'с отчетом о расхождениях'
+    )
+
+    def handle(self, *args, **options):
+        for counter in counters.COUNTERS:
+            model, field = counter[:2]
+            drift = counters.recount(*counter)
+            message = (
+                f'{model._meta.verbose_name_plural}.{field}: '
+                f'исправлено записей: {drift}'
+            )
+            if drift:
+                self.stdout.write(self.style.WARNING(message))
+            else:
+                self.stdout.write(self.style.SUCCESS(message))
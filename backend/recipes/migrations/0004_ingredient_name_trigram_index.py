@@ -0,0 +1,39 @@
+from django.db import migrations
+
+INDEX_NAME = 'recipes_ingredient_name_upper_trgm'
+
+
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    # psycopg нужен только на PostgreSQL.
+    from django.contrib.postgres.operations import TrigramExtension
+
+    TrigramExtension().database_forwards(
+        'recipes', schema_editor, None, None
+    )
+    schema_editor.execute(
+        f'CREATE INDEX IF NOT EXISTS {INDEX_NAME} ON recipes_ingredient '
+        'USING gin (UPPER(name) gin_trgm_ops)'
+    )
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    from django.contrib.postgres.operations import TrigramExtension
+
+    schema_editor.execute(f'DROP INDEX IF EXISTS {INDEX_NAME}')
+    TrigramExtension().database_backwards(
+        'recipes', schema_editor, None, None
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("recipes", "0003_alter_quantity_amount"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.10 on 2026-10-18 12:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("recipes", "0005_shoppinglistitem"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="recipe",
+            name="image_webp",
+            field=models.ImageField(
+                blank=True,
+                upload_to="recipe/images/webp/",
+                verbose_name="Картинка в WebP",
+            ),
+        ),
+        migrations.AddField(
+            model_name="recipe",
+            name="thumbnail",
+            field=models.ImageField(
+                blank=True, upload_to="recipe/thumbnails/", verbose_name="Миниатюра"
+            ),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.10 on 2026-10-18 12:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("recipes", "0007_recipe_image_derivatives"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="quantity",
+            index=models.Index(
+                fields=["recipe", "ingredient"], name="quantity_recipe_ingredient_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="recipe",
+            index=models.Index(fields=["-pub_date", "-id"], name="recipe_pub_date_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="recipe",
+            index=models.Index(
+                fields=["author", "-pub_date"], name="recipe_author_pub_date_idx"
+            ),
+        ),
+    ]
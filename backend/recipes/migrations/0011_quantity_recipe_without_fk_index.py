@@ -0,0 +1,24 @@
+# Generated by Django 4.2.10 on 2026-10-18 13:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("recipes", "0010_cache_table"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="quantity",
+            name="recipe",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="recipe_ingredients",
+                to="recipes.recipe",
+                verbose_name="Рецепт",
+            ),
+        ),
+    ]
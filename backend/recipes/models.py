@@ -3,7 +3,7 @@ from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db import models
 
 from foodgram import constants
-from users.models import User
+from users.models import CountersMixin, User
 
 
 class Tag(models.Model):
@@ -55,7 +55,8 @@ class Ingredient(models.Model):
         return f'{self.name} ({self.measurement_unit})'
 
 
-class Recipe(models.Model):
+class Recipe(CountersMixin, models.Model):
+    counter_fields = ('favorites_count',)
     name = models.CharField(
         'Название',
         max_length=constants.MAX_RECIPE_NAME,
@@ -81,6 +82,16 @@ class Recipe(models.Model):
         'Картинка',
         upload_to='recipe/images/',
     )
+    image_webp = models.ImageField(
+        'Картинка в WebP',
+        upload_to='recipe/images/webp/',
+        blank=True,
+    )
+    thumbnail = models.ImageField(
+        'Миниатюра',
+        upload_to='recipe/thumbnails/',
+        blank=True,
+    )
     text = models.TextField('Описание',)
     cooking_time = models.PositiveSmallIntegerField(
         'Время приготовления',
@@ -90,11 +101,26 @@ class Recipe(models.Model):
         )
     )
     pub_date = models.DateTimeField('Время публикации', auto_now_add=True)
+    favorites_count = models.PositiveIntegerField(
+        'Количество добавлений в избранное',
+        default=0,
+        editable=False,
+    )
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ('-pub_date',)
+        indexes = [
+            models.Index(
+                fields=('-pub_date', '-id'),
+                name='recipe_pub_date_idx',
+            ),
+            models.Index(
+                fields=('author', '-pub_date'),
+                name='recipe_author_pub_date_idx',
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -107,11 +133,14 @@ class Quantity(models.Model):
         verbose_name='Ингредиент',
         related_name='recipe_ingredients'
     )
+    # Поиск по рецепту идет по quantity_recipe_ingredient_idx,
+    # отдельный индекс внешнего ключа его только дублирует.
     recipe = models.ForeignKey(
         Recipe,
         on_delete=models.CASCADE,
         verbose_name='Рецепт',
-        related_name='recipe_ingredients'
+        related_name='recipe_ingredients',
+        db_index=False
     )
     amount = models.PositiveSmallIntegerField(
         'Количество',
@@ -123,6 +152,12 @@ class Quantity(models.Model):
 
     class Meta:
         verbose_name_plural = 'Ингредиенты рецепта'
+        indexes = [
+            models.Index(
+                fields=('recipe', 'ingredient'),
+                name='quantity_recipe_ingredient_idx',
+            ),
+        ]
 
     def __str__(self):
         return (
@@ -185,3 +220,32 @@ class Cart(models.Model):
 
     def __str__(self):
         return f'{self.user} добавил рецепт {self.recipe}'
+
+
+class ShoppingListItem(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь',
+        related_name='shopping_list'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='Ингредиент',
+        related_name='shopping_list_items'
+    )
+    total = models.PositiveIntegerField('Количество')
+
+    class Meta:
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Списки покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'ingredient'),
+                name="unique_shopping_list_items",
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user}: {self.ingredient} {self.total}'
@@ -0,0 +1,107 @@
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Sum
+
+from .models import Cart, Quantity, ShoppingListItem
+
+
+def get_recipe_amount(recipe_id):
+    """Подзапрос количества ингредиента строки списка покупок в рецепте."""
+    return Subquery(
+        Quantity.objects.filter(
+            recipe=recipe_id,
+            ingredient=OuterRef('ingredient')
+        ).values('ingredient').annotate(amount=Sum('amount')).values('amount')
+    )
+
+
+@transaction.atomic
+def add_recipe(user_id, recipe_id):
+    """Прибавляет ингредиенты рецепта к списку покупок пользователя."""
+    ingredient_ids = set(
+        Quantity.objects.filter(
+            recipe=recipe_id
+        ).values_list('ingredient', flat=True)
+    )
+    ShoppingListItem.objects.bulk_create(
+        [
+            ShoppingListItem(user_id=user_id, ingredient_id=pk, total=0)
+            for pk in ingredient_ids
+        ],
+        ignore_conflicts=True
+    )
+    ShoppingListItem.objects.filter(
+        user=user_id,
+        ingredient__in=ingredient_ids
+    ).update(total=F('total') + get_recipe_amount(recipe_id))
+
+
+@transaction.atomic
+def remove_recipe(user_id, recipe_id):
+    """
+    Вычитает ингредиенты рецепта из списка покупок пользователя.
+
+    Строки, в которых осталось не больше, чем в рецепте, удаляются,
+    а не уходят в минус, даже если список разошелся с корзиной.
+    """
+    items = ShoppingListItem.objects.filter(
+        user=user_id,
+        ingredient__in=Quantity.objects.filter(
+            recipe=recipe_id
+        ).values('ingredient')
+    )
+    amount = get_recipe_amount(recipe_id)
+    items.filter(total__lte=amount).delete()
+    items.update(total=F('total') - amount)
+
+
+@transaction.atomic
+def refresh(user_ids, ingredient_ids=None):
+    """
+    Пересчитывает строки списков покупок пользователей по их корзинам.
+
+    Возвращает количество строк, которые расходились с корзинами.
+    """
+    items = ShoppingListItem.objects.filter(user__in=user_ids)
+    quantities = Quantity.objects.filter(recipe__carts__user__in=user_ids)
+    if ingredient_ids is not None:
+        items = items.filter(ingredient__in=ingredient_ids)
+        quantities = quantities.filter(ingredient__in=ingredient_ids)
+    stored = {
+        (user_id, ingredient_id): (pk, total)
+        for pk, user_id, ingredient_id, total in items.values_list(
+            'pk', 'user', 'ingredient', 'total'
+        )
+    }
+    expected = {
+        (user_id, ingredient_id): total
+        for user_id, ingredient_id, total in quantities.values_list(
+            'recipe__carts__user',
+            'ingredient'
+        ).annotate(total=Sum('amount')).order_by()
+    }
+    drift = [
+        key for key in stored.keys() | expected.keys()
+        if stored.get(key, (None, None))[1] != expected.get(key)
+    ]
+    ShoppingListItem.objects.filter(
+        pk__in=[stored[key][0] for key in drift if key in stored]
+    ).delete()
+    ShoppingListItem.objects.bulk_create(
+        ShoppingListItem(
+            user_id=user_id,
+            ingredient_id=ingredient_id,
+            total=expected[user_id, ingredient_id]
+        )
+        for user_id, ingredient_id in drift
+        if (user_id, ingredient_id) in expected
+    )
+    return len(drift)
+
+
+def refresh_recipe(recipe_id, ingredient_ids):
+    """Пересчитывает списки покупок после изменения ингредиентов рецепта."""
+    user_ids = list(
+        Cart.objects.filter(recipe=recipe_id).values_list('user', flat=True)
+    )
+    if user_ids:
+        refresh(user_ids, ingredient_ids)
@@ -0,0 +1,210 @@
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+
+from users.models import Follow, User
+from . import counters, shopping_list
+from .models import Cart, Favorite, Ingredient, Quantity, Recipe, Tag
+from .versions import (COUNTERS_SCOPE, ROWS_SCOPE, bump_version,
+                       bump_versions)
+
+# Поля пользователя, которые выводятся в рецептах как данные автора.
+AUTHOR_FIELDS = ('email', 'username', 'first_name', 'last_name')
+
+# Внешние ключи, от которых зависят счетчики и списки покупок.
+LINK_FIELDS = {
+    Cart: ('user_id', 'recipe_id'),
+    Favorite: ('user_id', 'recipe_id'),
+    Follow: ('user_id', 'author_id'),
+    Recipe: ('author_id',),
+}
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+@receiver(post_delete, sender=User)
+def bump_model_version(sender, **kwargs):
+    bump_version(sender)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def bump_recipe_version(sender, instance, created=True, **kwargs):
+    """
+    Добавление, удаление рецепта и смена его автора меняют еще
+    и состав списков.
+    """
+    scopes = [None, instance.pk]
+    if created or get_moved_links(instance) is not None:
+        scopes.append(ROWS_SCOPE)
+    bump_versions(Recipe, scopes)
+
+
+@receiver(post_save, sender=Quantity)
+@receiver(post_delete, sender=Quantity)
+def bump_quantity_recipe_version(sender, instance, **kwargs):
+    bump_version(Recipe)
+    bump_version(Recipe, instance.recipe_id)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def bump_tagged_recipe_version(sender, instance, action, reverse, pk_set,
+                               **kwargs):
+    if not action.startswith('post_'):
+        return
+    recipe_ids = (pk_set or ()) if reverse else (instance.pk,)
+    bump_versions(Recipe, [None, ROWS_SCOPE, *recipe_ids])
+
+
+@receiver(pre_save, sender=User)
+def check_author_changed(sender, instance, update_fields, **kwargs):
+    """
+    Отмечает, изменились ли данные автора, которые видны в рецептах.
+
+    Регистрация, вход (last_login) и смена пароля их не меняют,
+    поэтому кэш рецептов из-за них не сбрасывается.
+    """
+    instance._author_changed = False
+    if instance._state.adding or (
+        update_fields is not None and not set(update_fields) & set(
+            AUTHOR_FIELDS
+        )
+    ):
+        return
+    saved = User.objects.filter(pk=instance.pk).values_list(
+        *AUTHOR_FIELDS
+    ).first()
+    instance._author_changed = saved != tuple(
+        getattr(instance, field) for field in AUTHOR_FIELDS
+    )
+
+
+@receiver(post_save, sender=User)
+def bump_author_recipes_version(sender, instance, **kwargs):
+    if not getattr(instance, '_author_changed', False):
+        return
+    bump_version(User)
+    bump_versions(Recipe, list(instance.recipes.values_list('id', flat=True)))
+
+
+@receiver(pre_save, sender=Recipe)
+@receiver(pre_save, sender=Favorite)
+@receiver(pre_save, sender=Cart)
+@receiver(pre_save, sender=Follow)
+def remember_saved_links(sender, instance, update_fields, **kwargs):
+    """
+    Запоминает внешние ключи записи из БД перед сохранением.
+
+    В админке их можно переназначить, и тогда зависящие от них данные
+    нужно перенести с прежних записей на новые.
+    """
+    instance._saved_links = None
+    fields = LINK_FIELDS[sender]
+    if instance._state.adding or (
+        update_fields is not None and not set(update_fields) & {
+            field.removesuffix('_id') for field in fields
+        }
+    ):
+        return
+    instance._saved_links = sender.objects.filter(
+        pk=instance.pk
+    ).values(*fields).first()
+
+
+def get_moved_links(instance):
+    """Прежние внешние ключи, если при сохранении хотя бы один изменился."""
+    saved = getattr(instance, '_saved_links', None)
+    if saved is None or all(
+        getattr(instance, field) == value for field, value in saved.items()
+    ):
+        return None
+    return saved
+
+
+def move_counter(model, field, instance, link, created):
+    """
+    Прибавляет счетчик записи, на которую ссылается link; если связь
+    переназначили, вычитает его у прежней записи.
+
+    Возвращает pk записей, счетчик которых изменился.
+    """
+    pks = []
+    if not created:
+        saved = get_moved_links(instance)
+        if saved is None or saved[link] == getattr(instance, link):
+            return pks
+        counters.change(model, saved[link], field, -1)
+        pks.append(saved[link])
+    pks.append(getattr(instance, link))
+    counters.change(model, pks[-1], field, 1)
+    return pks
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+@receiver(post_save, sender=Cart)
+@receiver(post_delete, sender=Cart)
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def bump_user_version(sender, instance, **kwargs):
+    user_ids = [instance.user_id]
+    saved = get_moved_links(instance)
+    if saved is not None:
+        user_ids.append(saved['user_id'])
+    bump_versions(sender, user_ids)
+
+
+@receiver(post_save, sender=Cart)
+def add_to_shopping_list(sender, instance, created, **kwargs):
+    if not created:
+        saved = get_moved_links(instance)
+        if saved is None:
+            return
+        shopping_list.remove_recipe(saved['user_id'], saved['recipe_id'])
+    shopping_list.add_recipe(instance.user_id, instance.recipe_id)
+
+
+@receiver(pre_delete, sender=Cart)
+def remove_from_shopping_list(sender, instance, **kwargs):
+    shopping_list.remove_recipe(instance.user_id, instance.recipe_id)
+
+
+@receiver(post_save, sender=Recipe)
+def increment_recipes_count(sender, instance, created, **kwargs):
+    move_counter(User, 'recipes_count', instance, 'author_id', created)
+
+
+@receiver(post_delete, sender=Recipe)
+def decrement_recipes_count(sender, instance, **kwargs):
+    counters.change(User, instance.author_id, 'recipes_count', -1)
+
+
+@receiver(post_save, sender=Follow)
+def increment_followers_count(sender, instance, created, **kwargs):
+    move_counter(User, 'followers_count', instance, 'author_id', created)
+
+
+@receiver(post_delete, sender=Follow)
+def decrement_followers_count(sender, instance, **kwargs):
+    counters.change(User, instance.author_id, 'followers_count', -1)
+
+
+@receiver(post_save, sender=Favorite)
+def increment_favorites_count(sender, instance, created, **kwargs):
+    """
+    Общая версия рецептов не меняется: в списки из кэша счетчик
+    подставляется при чтении, а количество рецептов от него не зависит.
+    """
+    recipe_ids = move_counter(
+        Recipe, 'favorites_count', instance, 'recipe_id', created
+    )
+    if recipe_ids:
+        bump_versions(Recipe, (*recipe_ids, COUNTERS_SCOPE))
+
+
+@receiver(post_delete, sender=Favorite)
+def decrement_favorites_count(sender, instance, **kwargs):
+    counters.change(Recipe, instance.recipe_id, 'favorites_count', -1)
+    bump_versions(Recipe, (instance.recipe_id, COUNTERS_SCOPE))
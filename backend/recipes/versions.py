@@ -0,0 +1,96 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+VERSION_KEY = 'version:{}'
+
+# Версии модели, которые меняются реже общей: ROWS_SCOPE - при добавлении
+# и удалении записей и смене связей, по которым фильтруется список,
+# COUNTERS_SCOPE - при изменении денормализованных счетчиков.
+ROWS_SCOPE = 'rows'
+COUNTERS_SCOPE = 'counters'
+
+# Копии версий в памяти процесса: ключ -> (версия, когда перечитать).
+_local_versions = {}
+
+
+def get_version_key(model, scope=None):
+    key = VERSION_KEY.format(model._meta.label_lower)
+    if scope is not None:
+        key = f'{key}:{scope}'
+    return key
+
+
+def get_version(model, scope=None):
+    """
+    Возвращает текущую версию данных модели.
+
+    scope позволяет вести отдельные версии, например, для записей
+    одного пользователя.
+
+    Если версии еще нет в кэше, она создается из текущего времени,
+    чтобы после очистки кэша не совпасть ни с одной из прежних версий.
+    """
+    return get_versions((model, scope))[0]
+
+
+def get_versions(*items):
+    """
+    Возвращает версии для пар (модель, scope) одним обращением к кэшу.
+
+    Недостающие версии создаются так же, как в get_version().
+    """
+    keys = [get_version_key(model, scope) for model, scope in items]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def get_local_version(model):
+    """
+    Возвращает версию модели, сверяясь с общим кэшем не чаще раза
+    в VERSION_LOCAL_TIMEOUT секунд.
+
+    Изменения из других процессов становятся видны с этой задержкой,
+    изменения в текущем процессе - сразу после фиксации транзакции.
+    """
+    key = get_version_key(model)
+    cached = _local_versions.get(key)
+    now = time.monotonic()
+    if cached is None or cached[1] <= now:
+        cached = (get_version(model), now + settings.VERSION_LOCAL_TIMEOUT)
+        _local_versions[key] = cached
+    return cached[0]
+
+
+def clear_local_versions():
+    _local_versions.clear()
+
+
+def forget_versions(keys):
+    for key in keys:
+        _local_versions.pop(key, None)
+    cache.delete_many(keys)
+
+
+def bump_version(model, scope=None):
+    """Меняет версию модели после фиксации текущей транзакции."""
+    bump_versions(model, (scope,))
+
+
+def bump_versions(model, scopes):
+    """
+    Меняет версии модели для нескольких scope после фиксации транзакции.
+
+    Версии удаляются из кэша одним запросом и при следующем чтении
+    создаются заново из текущего времени, поэтому не совпадают
+    с прежними.
+    """
+    keys = [get_version_key(model, scope) for scope in scopes]
+    if keys:
+        transaction.on_commit(lambda: forget_versions(keys))
@@ -5,9 +5,36 @@ from django.db import models
 from foodgram import constants
 
 
-class User(AbstractUser):
+class CountersMixin:
+    """
+    Не записывает денормализованные счетчики при сохранении объекта.
+
+    Счетчики меняются только атомарными F()-обновлениями, а save()
+    вернул бы им значения, прочитанные при загрузке объекта.
+    """
+
+    counter_fields = ()
+
+    def save(self, *args, update_fields=None, **kwargs):
+        if not (
+            update_fields is not None
+            or self._state.adding
+            or kwargs.get('force_insert')
+        ):
+            deferred = self.get_deferred_fields()
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.attname not in deferred
+                and field.name not in self.counter_fields
+            ]
+        super().save(*args, update_fields=update_fields, **kwargs)
+
+
+class User(CountersMixin, AbstractUser):
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ('username', 'first_name', 'last_name', 'password')
+    counter_fields = ('recipes_count', 'followers_count')
     email = models.EmailField(
         'Почта',
         unique=True,
@@ -30,6 +57,16 @@ class User(AbstractUser):
         'Пароль',
         max_length=constants.MAX_PASSWORD,
     )
+    recipes_count = models.PositiveIntegerField(
+        'Количество рецептов',
+        default=0,
+        editable=False,
+    )
+    followers_count = models.PositiveIntegerField(
+        'Количество подписчиков',
+        default=0,
+        editable=False,
+    )
 
     class Meta:
         verbose_name = 'Пользователь'